@@ -1,21 +1,112 @@
+import os
+
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
 
-# configuration
+from alayatodo.database import configure_database, RoutingSQLAlchemy
+from alayatodo.instrumentation import init_instrumentation
+from alayatodo.sessions import init_sessions
+
+# configuration, the database settings can be overridden from the environment
 DATABASE = '/tmp/alayatodo.db'
 DEBUG = True
-SECRET_KEY = 'development key'
-SQLALCHEMY_DATABASE_URI = 'sqlite:///{}'.format(DATABASE)
+SECRET_KEY = os.environ.get('SECRET_KEY', 'development key')
+SQLALCHEMY_DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///{}'.format(DATABASE))
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'development')
+DATABASE_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URI')
+REPLICA_LAG_SECONDS = int(os.environ.get('REPLICA_LAG_SECONDS', 5))
 FLASK_APP = 'alayatodo.py'
+# server side sessions, 'sqlite' (shared by the processes of the host) or 'memory' (per process), see alayatodo.sessions
+SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+# None keeps them in a directory private to the user running the app, see alayatodo.sessions.SqliteStore
+SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH')
+SESSION_MAX_ENTRIES = 10000
 TODOS_PER_PAGE = 10
+# largest per_page the todo list accepts, render time and page size grow with it
+TODOS_PER_PAGE_LIMIT = 100
+# compiled templates are cached on disk, so new worker processes do not compile them again. Without a directory Jinja
+# uses a private one of the user it runs as, empty disables the cache
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+HOME_CACHE_SIZE = 1000
+API_PAGE_LIMIT = 100
+API_BATCH_LIMIT = 500
+SYNC_PAGE_LIMIT = 1000
+EXPORT_BATCH_SIZE = 1000
+# werkzeug hash method, iterations included, of new passwords. Hashes with other parameters are upgraded on login,
+# see benchmarks.hashing to pick a cost
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+# password checks run in a pool of LOGIN_HASH_WORKERS threads (0 checks them on the request thread), see
+# alayatodo.security
+LOGIN_HASH_WORKERS = int(os.environ.get('LOGIN_HASH_WORKERS', 2))
+LOGIN_HASH_QUEUE_SIZE = 16
+LOGIN_HASH_TIMEOUT = 2.0
+# failures per username are counted per IP address too, so nobody can lock another user out from elsewhere
+LOGIN_MAX_FAILURES_PER_USERNAME = 5
+LOGIN_MAX_FAILURES_PER_IP = 50
+LOGIN_FAILURE_WINDOW = 300
+# bulk operations run by JOB_WORKERS threads (0 runs them in the request), JOB_CHUNK_SIZE todos per transaction, see
+# alayatodo.jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))
+JOB_CHUNK_SIZE = 1000
+JOB_LEASE_SECONDS = 60
+JOB_IMPORT_LIMIT = 100000
+# change feed streams (see alayatodo.feed) last FEED_MAX_SECONDS, and look for changes of other processes every
+# FEED_POLL_SECONDS
+FEED_POLL_SECONDS = 5
+FEED_MAX_SECONDS = 300
+FEED_BATCH_SIZE = 100
+FEED_RETRY_MILLISECONDS = 3000
+# changes older than FEED_RETENTION_DAYS are pruned along with the archiving of todos, streams resuming from before then
+# start with a reset
+FEED_RETENTION_DAYS = 7
+# completed todos move to the todo_archive table ARCHIVE_AFTER_DAYS after they were completed, ARCHIVE_CHUNK_SIZE per
+# transaction, when running main.py archive or every ARCHIVE_INTERVAL_SECONDS (0 never) in the app processes, see
+# alayatodo.archive
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 0))
+ARCHIVE_CHUNK_SIZE = 1000
+# per request SQL instrumentation, see alayatodo.instrumentation
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION') == '1'
+SQL_QUERY_BUDGETS = {'todo': 2, 'todos': 3, 'todos_post': 3, 'todo_update': 4, 'todo_delete': 5, 'todo_json': 2,
+                     'show_completed': 3, 'api_todos': 2, 'api_search_todos': 1, 'api_job': 1,
+                     'api_todo_changes': 2}
+SQL_QUERY_BUDGET_STRICT = False
+SQL_SLOWEST_STATEMENTS = 3
+SQL_REPEATED_THRESHOLD = 3
+
+
+def template_bytecode_cache(directory):
+    """
+    Bytecode cache of the compiled templates in `directory`, created private to the user running the app. Jinja loads
+    and runs whatever it finds there, so without a directory it picks its own, and checks who owns it
+    """
+    if directory == '':
+        return None
+    if directory is None:
+        return FileSystemBytecodeCache()
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    return FileSystemBytecodeCache(directory)
+
+
+class AlayaTodo(Flask):
+    def create_jinja_environment(self):
+        # on first use of the templates rather than on import
+        environment = Flask.create_jinja_environment(self)
+        environment.bytecode_cache = template_bytecode_cache(self.config['TEMPLATE_CACHE_DIR'])
+        return environment
+
 
-app = Flask(__name__)
+app = AlayaTodo(__name__)
 app.config.from_object(__name__)
-db = SQLAlchemy(app)
+configure_database(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 csrf = CSRFProtect(app)
+init_instrumentation(app)
+init_sessions(app)
 
-from alayatodo import views, models, errors
+from alayatodo import views, models, errors, api
@@ -0,0 +1,275 @@
+import csv
+import functools
+import itertools
+import json
+import sys
+
+from flask import request, session, jsonify, Response, stream_with_context, url_for
+
+from alayatodo import app, db
+from alayatodo.archive import with_archived_todos
+from alayatodo.database import read_only
+from alayatodo.feed import stream_changes
+from alayatodo.jobs import JOB_KINDS, invalid_import, queue_job
+from alayatodo.models import Job, Todo, TODO_FIELDS, serialize_todos
+from alayatodo.pagination import paginate_todos
+from alayatodo.search import search_todos
+from alayatodo.sync import todo_changes, todos_version
+
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# the csv module of Python 2 only writes byte strings
+CSV_BYTES = sys.version_info[0] == 2
+
+
+def require_api_login(function):
+    """
+    Same as views.require_login, but answers with a JSON error instead of redirecting to the login page
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not session.get('user_id'):
+            return jsonify({'status': 401, 'message': 'Please login to access this page.'}), 401
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+@app.route('/api/todos', methods=['GET'])
+@require_api_login
+@read_only
+def api_todos():
+    limit = min(max(request.args.get('limit', app.config['TODOS_PER_PAGE'], type=int), 1),
+                app.config['API_PAGE_LIMIT'])
+    query = db.session.query(Todo).filter(Todo.user_id == session['user_id'])
+    try:
+        page = paginate_todos(query, request.args.get('after'), limit, True, session['user_id'])
+    except ValueError:
+        return jsonify({'status': 400, 'message': 'Invalid cursor.'}), 400
+    return jsonify({'status': 200, 'message': 'Success', 'todos': serialize_todos(page.items),
+                    'next': page.next_cursor})
+
+
+@app.route('/api/todos/changes', methods=['GET'])
+@require_api_login
+@read_only
+def api_todo_changes():
+    """
+    Delta sync: the todos changed since the todos version `since`, and the ids of the ones deleted since, `limit` at a
+    time following the `next` cursor. Without `since` every todo is returned. The `version` of the last page is the
+    `since` of the next sync
+    """
+    since = request.args.get('since')
+    if since is not None and not since.isdigit():
+        return jsonify({'status': 400, 'message': 'Invalid version.'}), 400
+    limit = min(max(request.args.get('limit', app.config['SYNC_PAGE_LIMIT'], type=int), 1),
+                app.config['SYNC_PAGE_LIMIT'])
+    # read before the changes, whatever is written in between is sent again next time rather than missed
+    version = todos_version(session['user_id'])
+    try:
+        rows, next_cursor = todo_changes(session['user_id'], int(since) if since is not None else None,
+                                         request.args.get('after'), limit)
+    except ValueError:
+        return jsonify({'status': 400, 'message': 'Invalid cursor.'}), 400
+    return jsonify({'status': 200, 'message': 'Success',
+                    'todos': serialize_todos(row for row in rows if not row.deleted),
+                    'deleted': [row.id for row in rows if row.deleted], 'next': next_cursor, 'version': version})
+
+
+@app.route('/api/todos/search', methods=['GET'])
+@require_api_login
+@read_only
+def api_search_todos():
+    """
+    Todos containing every word of `q`, best match first, `limit` per page
+    """
+    terms = request.args.get('q', '').split()
+    if not terms:
+        return jsonify({'status': 400, 'message': 'Nothing to search for.'}), 400
+    limit = min(max(request.args.get('limit', app.config['TODOS_PER_PAGE'], type=int), 1),
+                app.config['API_PAGE_LIMIT'])
+    page = max(request.args.get('page', 1, type=int), 1)
+    todos, has_next = search_todos(session['user_id'], terms, page, limit)
+    return jsonify({'status': 200, 'message': 'Success', 'todos': serialize_todos(todos),
+                    'next_page': page + 1 if has_next else None})
+
+
+@app.route('/api/todos', methods=['POST'])
+@require_api_login
+def api_todos_batch():
+    """
+    Applies a batch of changes in a single transaction. The body looks like
+    {"create": [{"description": "..."}], "update": [{"id": 1, "completed": true}], "delete": [2, 3]}
+    and every item gets its own result, so one invalid item does not prevent the rest of the batch from being applied
+    """
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, dict) or not all(isinstance(batch.get(key, []), list) for key in BATCH_OPERATIONS):
+        return jsonify({'status': 400, 'message': 'Expected a JSON object with create, update and delete lists.'}), 400
+    if sum(len(batch.get(key, [])) for key in BATCH_OPERATIONS) > app.config['API_BATCH_LIMIT']:
+        return jsonify({'status': 400, 'message': 'Batches cannot have more than {} items.'.format(
+            app.config['API_BATCH_LIMIT'])}), 400
+    user_id = session['user_id']
+    ids = [item.get('id') if isinstance(item, dict) else None for item in batch.get('update', [])]
+    ids.extend(batch.get('delete', []))
+    ids = [todo_id for todo_id in ids if _is_id(todo_id)]
+    # a single query loads every todo the batch touches
+    todos = {}
+    if ids:
+        todos = {todo.id: todo for todo in
+                 db.session.query(Todo).filter(Todo.id.in_(ids), Todo.user_id == user_id)}
+    results = {
+        'create': [_create_todo(item, user_id) for item in batch.get('create', [])],
+        'update': [_update_todo(item, todos) for item in batch.get('update', [])],
+        'delete': [_delete_todo(todo_id, todos) for todo_id in batch.get('delete', [])],
+    }
+    db.session.flush()
+    changed = [result for result in results['create'] + results['update'] if 'todo' in result]
+    for result, data in zip(changed, serialize_todos(result['todo'] for result in changed)):
+        result['todo'] = data
+    db.session.commit()
+    return jsonify({'status': 200, 'message': 'Success', 'results': results})
+
+
+@app.route('/api/todos/jobs', methods=['POST'])
+@require_api_login
+def api_queue_job():
+    """
+    Queues a bulk operation on the todos of the user, {"kind": "complete_all"}, {"kind": "delete_completed"} or
+    {"kind": "import", "descriptions": ["..."]}. Its status can be polled at the URL of the Location header
+    """
+    body = request.get_json(silent=True)
+    kind = body.get('kind') if isinstance(body, dict) else None
+    if kind not in JOB_KINDS:
+        return jsonify({'status': 400, 'message': 'Expected a JSON object with a kind among {}.'.format(
+            ', '.join(JOB_KINDS))}), 400
+    payload = None
+    if kind == 'import':
+        error = invalid_import(body.get('descriptions'))
+        if error:
+            return jsonify({'status': 400, 'message': error}), 400
+        payload = {'descriptions': body['descriptions']}
+    job_id = queue_job(session['user_id'], kind, payload)
+    response = jsonify({'status': 202, 'message': 'Job queued.', 'job': {'id': job_id}})
+    response.headers['Location'] = url_for('api_job', job_id=job_id)
+    return response, 202
+
+
+@app.route('/api/todos/jobs/<int:job_id>', methods=['GET'])
+@require_api_login
+def api_job(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=session['user_id']).first()
+    if job is None:
+        return jsonify({'status': 404, 'message': 'That job does not exist.'}), 404
+    if session.get('job_id') == job_id and job.status in ('done', 'failed'):
+        # the todo list stops polling it
+        session.pop('job_id')
+    return jsonify({'status': 200, 'message': 'Success', 'job': job.as_dict()})
+
+
+@app.route('/api/todos/events', methods=['GET'])
+@require_api_login
+def api_todo_events():
+    """
+    Server-Sent Events feed of the changes to the todos of the user. Clients resume after the change of the
+    Last-Event-ID header, or of last_event_id in the query string, and only get what they missed
+    """
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        return jsonify({'status': 400, 'message': 'Invalid event id.'}), 400
+    response = Response(stream_with_context(stream_changes(session['user_id'], last_id)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx would otherwise hold the events back until its buffer fills up
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/todos/export.<any(ndjson, csv):export_format>', methods=['GET'])
+@require_api_login
+@read_only
+def api_todos_export(export_format):
+    """
+    Streams every todo of the user, archived ones included, reading them in batches of EXPORT_BATCH_SIZE so memory does
+    not grow with the list
+    """
+    rows = with_archived_todos(db.session.query(Todo).filter(Todo.user_id == session['user_id']), session['user_id']) \
+        .order_by(Todo.id).yield_per(app.config['EXPORT_BATCH_SIZE'])
+    todos = _serialize_batches(rows, app.config['EXPORT_BATCH_SIZE'])
+    lines = _ndjson_lines(todos) if export_format == 'ndjson' else _csv_lines(todos)
+    response = Response(stream_with_context(lines), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = 'attachment; filename=todos.{}'.format(export_format)
+    return response
+
+
+def _serialize_batches(rows, batch_size):
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, batch_size))
+    while batch:
+        for todo in serialize_todos(batch):
+            yield todo
+        batch = list(itertools.islice(rows, batch_size))
+
+
+def _ndjson_lines(todos):
+    for todo in todos:
+        yield json.dumps(todo, sort_keys=True) + '\n'
+
+
+class _Line(object):
+    """
+    Pseudo file for csv.writer, which hands back every row it is asked to write instead of buffering it
+    """
+
+    def write(self, value):
+        return value.decode('utf-8') if CSV_BYTES else value
+
+
+def _csv_lines(todos):
+    # same fields as /todo/<id>/json, so both exports describe a todo the same way
+    writer = csv.writer(_Line())
+    yield writer.writerow(TODO_FIELDS)
+    for todo in todos:
+        yield writer.writerow([_csv_cell(todo[field]) for field in TODO_FIELDS])
+
+
+def _csv_cell(value):
+    return value.encode('utf-8') if CSV_BYTES and hasattr(value, 'encode') else value
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _create_todo(item, user_id):
+    if not isinstance(item, dict):
+        return {'status': 400, 'message': 'Expected an object with a description.'}
+    # checked here rather than left to the database, which would fail the whole batch
+    if isinstance(item.get('description'), type(u'')) and len(item['description']) > 255:
+        return {'status': 400, 'message': 'Todo description cannot be longer than 255 characters'}
+    try:
+        todo = Todo(description=item.get('description'), user_id=user_id, completed=False)
+    except (AssertionError, TypeError, AttributeError):
+        return {'status': 400, 'message': 'Todo description cannot be empty'}
+    db.session.add(todo)
+    return {'status': 201, 'todo': todo}
+
+
+def _update_todo(item, todos):
+    if not isinstance(item, dict) or not isinstance(item.get('completed'), bool):
+        return {'status': 400, 'message': 'Expected an object with an id and a boolean completed.'}
+    todo = todos.get(item.get('id')) if _is_id(item.get('id')) else None
+    if todo is None:
+        return {'status': 404, 'id': item.get('id'), 'message': 'That todo does not exist.'}
+    todo.completed = item['completed']
+    return {'status': 200, 'todo': todo}
+
+
+def _delete_todo(todo_id, todos):
+    todo = todos.pop(todo_id, None) if _is_id(todo_id) else None
+    if todo is None:
+        return {'status': 404, 'id': todo_id, 'message': 'That todo does not exist.'}
+    db.session.delete(todo)
+    return {'status': 200, 'id': todo_id}
@@ -0,0 +1,110 @@
+import datetime
+import threading
+import time
+
+from alayatodo import app, db
+from alayatodo.feed import prune_changes
+from alayatodo.models import (ArchivedTodo, Todo, TodoTombstone, User, ARCHIVED_TODO_COLUMNS, TODO_COLUMNS,
+                              current_todos_version, log_todo_change, todos_changed)
+
+todos = Todo.__table__
+archived_todos = ArchivedTodo.__table__
+tombstones = TodoTombstone.__table__
+users = User.__table__
+# columns an archived todo keeps from the todo table
+ARCHIVED_COLUMNS = ('id', 'description', 'completed', 'user_id', 'version', 'completed_at')
+
+
+def archive_todos(older_than, chunk_size):
+    """
+    Moves the todos completed more than `older_than` (a timedelta) ago to the archive, `chunk_size` at a time, each
+    chunk in a transaction of its own so the todo table is never locked for long. Returns how many were moved
+    """
+    cutoff = datetime.datetime.utcnow() - older_than
+    select_ids = db.select([todos.c.id]).where(db.and_(
+        todos.c.completed == True, todos.c.completed_at < cutoff)).limit(chunk_size)
+    moved = 0
+    while True:
+        with db.engine.begin() as connection:
+            # locked, so a todo marked as not completed meanwhile is not archived (SQLite locks the whole database)
+            ids = [todo_id for todo_id, in connection.execute(select_ids.with_for_update())]
+            if not ids:
+                return moved
+            now = datetime.datetime.utcnow()
+            connection.execute(archived_todos.insert().from_select(
+                list(ARCHIVED_COLUMNS) + ['archived_at'],
+                db.select([todos.c[column] for column in ARCHIVED_COLUMNS] + [db.literal(now)])
+                .where(todos.c.id.in_(ids))))
+            connection.execute(todos.delete().where(todos.c.id.in_(ids)))
+            # nothing changed for sync clients, but the todo pages of the users show the todos as archived now
+            connection.execute(users.update().where(users.c.id.in_(
+                db.select([archived_todos.c.user_id]).where(archived_todos.c.id.in_(ids)).distinct()))
+                               .values(todos_version=users.c.todos_version + 1))
+        moved += len(ids)
+
+
+def with_archived_todos(query, user_id, *criteria):
+    """
+    Rows of `query`, a query of todos filtered by user, along with the archived todos of `user_id` matching `criteria`,
+    as TODO_COLUMNS tuples with an `archived` flag. Filters, ordering and limits added afterwards apply to both
+    """
+    archived = db.session.query(*ARCHIVED_TODO_COLUMNS + (db.literal_column('1').label('archived'),)) \
+        .filter(ArchivedTodo.user_id == user_id, *criteria)
+    return query.with_entities(*TODO_COLUMNS + (db.literal_column('0').label('archived'),)).union_all(archived)
+
+
+def find_todo(user_id, todo_id):
+    """
+    The todo `todo_id` of a user, archived or not, in a single query. See with_archived_todos
+    """
+    query = db.session.query(Todo).filter(Todo.id == todo_id, Todo.user_id == user_id)
+    return with_archived_todos(query, user_id, ArchivedTodo.id == todo_id).first()
+
+
+def delete_archived_todo(user_id, todo_id):
+    """
+    Deletes an archived todo of a user within the session's transaction, keeping the counters, sync tombstones and
+    change log the way the todo listeners of alayatodo.models do. Returns whether there was one
+    """
+    connection = db.session.connection()
+    deleted = connection.execute(archived_todos.delete().where(db.and_(
+        archived_todos.c.id == todo_id, archived_todos.c.user_id == user_id))).rowcount
+    if not deleted:
+        return False
+    todos_changed(connection, user_id, -1, 0)
+    connection.execute(tombstones.insert().values(
+        todo_id=todo_id, user_id=user_id, version=current_todos_version(user_id)))
+    log_todo_change(connection, user_id, 'deleted', todo_id)
+    db.session.info['todo_changes'] = True
+    return True
+
+
+def archive_periodically(interval, older_than, chunk_size):
+    """
+    Archives todos, and prunes the change log, every `interval` seconds on a daemon thread, for deployments that do not
+    run main.py archive
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    archive_todos(older_than, chunk_size)
+                    prune_changes(datetime.timedelta(days=app.config['FEED_RETENTION_DAYS']), chunk_size)
+                except Exception:
+                    app.logger.exception('Archiving todos failed')
+
+    thread = threading.Thread(target=run, name='todo-archiver')
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+@app.before_first_request
+def start_archiving():
+    # like resume_jobs, here rather than at import time so every forked worker starts its own thread
+    if app.config['ARCHIVE_INTERVAL_SECONDS']:
+        archive_periodically(app.config['ARCHIVE_INTERVAL_SECONDS'],
+                             datetime.timedelta(days=app.config['ARCHIVE_AFTER_DAYS']),
+                             app.config['ARCHIVE_CHUNK_SIZE'])
@@ -0,0 +1,102 @@
+import functools
+import os
+import sqlite3
+import time
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+REPLICA_BIND = 'replica'
+
+# Pragmas are applied in order on every new SQLite connection. WAL lets readers carry on while a writer commits, and
+# with WAL synchronous=NORMAL is still safe against corruption, only the last commits may be lost on power failure
+PRODUCTION_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64 * 1024),
+]
+
+
+def profile_config(profile, database_uri):
+    """
+    Returns the configuration keys for a database profile. 'development' keeps the driver defaults, 'production' tunes
+    the pool (and SQLite itself) for concurrent readers and writers. Pool settings can be overridden with
+    DATABASE_POOL_SIZE and DATABASE_POOL_RECYCLE environment variables
+    """
+    if profile == 'development':
+        return {'SQLITE_PRAGMAS': [], 'SQLALCHEMY_ENGINE_OPTIONS': {}}
+    if profile != 'production':
+        raise ValueError('Unknown database profile {}'.format(profile))
+    engine_options = {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 10)),
+        'max_overflow': 10,
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 3600)),
+    }
+    if make_url(database_uri).get_backend_name() != 'sqlite':
+        return {'SQLITE_PRAGMAS': [], 'SQLALCHEMY_ENGINE_OPTIONS': engine_options}
+    # SQLAlchemy would pick a NullPool for SQLite files, opening a connection (and running the pragmas) on every
+    # checkout
+    engine_options.update({'poolclass': QueuePool, 'connect_args': {'check_same_thread': False}})
+    return {'SQLITE_PRAGMAS': PRODUCTION_PRAGMAS, 'SQLALCHEMY_ENGINE_OPTIONS': engine_options}
+
+
+def configure_database(app):
+    app.config.update(profile_config(app.config['DATABASE_PROFILE'], app.config['SQLALCHEMY_DATABASE_URI']))
+    if app.config['DATABASE_REPLICA_URI']:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: app.config['DATABASE_REPLICA_URI']}
+
+    @event.listens_for(Engine, 'connect')
+    def apply_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config['SQLITE_PRAGMAS']:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+
+def read_only(function):
+    """
+    Decorator for views that never write, so their queries can be answered by the read replica if there is one
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    """
+    Sends the queries of read only views to the replica bind, and everything else to the primary database. After a
+    write the user keeps reading from the primary for REPLICA_LAG_SECONDS, so they always see their own changes
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing and has_request_context():
+            session['primary_until'] = time.time() + self.app.config['REPLICA_LAG_SECONDS']
+        elif self._use_replica():
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _use_replica(self):
+        return has_request_context() and g.get('read_only', False) \
+               and REPLICA_BIND in (self.app.config['SQLALCHEMY_BINDS'] or {}) \
+               and session.get('primary_until', 0) < time.time()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,155 @@
+import datetime
+import json
+import threading
+import time
+
+from sqlalchemy import event
+
+from alayatodo import app, db
+from alayatodo.database import RoutingSession
+from alayatodo.models import Todo, TodoChange, serialize_todos
+
+changes = TodoChange.__table__
+todos = Todo.__table__
+
+
+class ChangeFeed(object):
+    """
+    Lets the change streams of this process sleep until a change is committed, instead of reading the change log over
+    and over. Changes committed by other processes are noticed when a stream's wait times out, every FEED_POLL_SECONDS.
+    When serving with gevent (see alayatodo.serving) the condition is a greenlet one, so an idle stream costs a
+    greenlet rather than a thread
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def notify(self):
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation, timeout):
+        """
+        Waits up to `timeout` seconds for a notification after `generation`, and returns the current generation
+        """
+        with self._condition:
+            if self._generation == generation:
+                self._condition.wait(timeout)
+            return self._generation
+
+
+change_feed = ChangeFeed()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _notify_committed_changes(session):
+    # set by the todo listeners of alayatodo.models
+    if session.info.pop('todo_changes', False):
+        change_feed.notify()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_rolled_back_changes(session):
+    session.info.pop('todo_changes', None)
+
+
+def latest_change(user_id):
+    with db.engine.connect() as connection:
+        return connection.execute(db.select([db.func.max(changes.c.id)]).where(changes.c.user_id == user_id)) \
+            .scalar() or 0
+
+
+def change_window():
+    """
+    Ids of the oldest and latest changes kept, of every user
+    """
+    with db.engine.connect() as connection:
+        return tuple(connection.execute(db.select([db.func.min(changes.c.id), db.func.max(changes.c.id)])).first())
+
+
+def prune_changes(older_than, chunk_size):
+    """
+    Deletes the changes logged more than `older_than` (a timedelta) ago, `chunk_size` at a time. The latest change is
+    always kept, so streams can tell whether changes they have not sent were pruned. Returns how many were deleted
+    """
+    cutoff = datetime.datetime.utcnow() - older_than
+    latest = db.select([db.func.max(changes.c.id)]).as_scalar()
+    select_ids = db.select([changes.c.id]).where(db.and_(changes.c.created_at < cutoff, changes.c.id < latest)) \
+        .order_by(changes.c.id).limit(chunk_size)
+    deleted = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = [change_id for change_id, in connection.execute(select_ids)]
+            if not ids:
+                return deleted
+            connection.execute(changes.delete().where(changes.c.id.in_(ids)))
+        deleted += len(ids)
+
+
+def read_changes(user_id, after, limit):
+    """
+    Up to `limit` changes of `user_id` logged after the change `after`, oldest first, along with the current state of
+    their todo. They are read from the primary database on a connection of their own, as a stream outlives any
+    transaction it could share with the request
+    """
+    query = db.select([changes.c.id.label('change_id'), changes.c.action, changes.c.todo_id,
+                       todos.c.id, todos.c.description, todos.c.completed, todos.c.user_id]) \
+        .select_from(changes.outerjoin(todos, db.and_(todos.c.id == changes.c.todo_id,
+                                                      todos.c.user_id == changes.c.user_id,
+                                                      changes.c.action != 'deleted'))) \
+        .where(db.and_(changes.c.user_id == user_id, changes.c.id > after)).order_by(changes.c.id).limit(limit)
+    with db.engine.connect() as connection:
+        return connection.execute(query).fetchall()
+
+
+def reset_event(change_id):
+    data = {'action': 'reset', 'todo_id': None, 'todo': None}
+    return 'id: {}\nevent: reset\ndata: {}\n\n'.format(change_id, json.dumps(data, sort_keys=True))
+
+
+def change_event(row):
+    """
+    Server-Sent Event of a change. Its todo is null when it has been deleted since
+    """
+    data = {'action': row.action, 'todo_id': row.todo_id,
+            'todo': serialize_todos([row])[0] if row.id is not None else None}
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(row.change_id, 'reset' if row.action == 'reset' else 'todo',
+                                                    json.dumps(data, sort_keys=True))
+
+
+def stream_changes(user_id, last_id=None):
+    """
+    Server-Sent Events of the changes of `user_id` after the change `last_id`, or after the latest one when there is
+    none. The stream ends after FEED_MAX_SECONDS, and browsers reconnect by themselves, sending the id of the last
+    event they got as Last-Event-ID. When changes after `last_id` have been pruned it starts with a reset event
+    """
+    deadline = time.time() + app.config['FEED_MAX_SECONDS']
+    yield 'retry: {}\n\n'.format(app.config['FEED_RETRY_MILLISECONDS'])
+    if last_id is None:
+        last_id = latest_change(user_id)
+    else:
+        oldest, latest = change_window()
+        if oldest is not None and last_id + 1 < oldest:
+            # the changes in between may have been the user's, they are gone, so the client loads its list again
+            last_id = latest
+            yield reset_event(latest)
+    while True:
+        generation = change_feed.generation
+        rows = read_changes(user_id, last_id, app.config['FEED_BATCH_SIZE'])
+        for row in rows:
+            last_id = row.change_id
+            yield change_event(row)
+        if len(rows) == app.config['FEED_BATCH_SIZE']:
+            continue
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if change_feed.wait(generation, min(app.config['FEED_POLL_SECONDS'], remaining)) == generation:
+            # nothing new, but proxies would close a connection that stays silent
+            yield ': keepalive\n\n'
@@ -0,0 +1,90 @@
+import collections
+from timeit import default_timer
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryLog(object):
+    """
+    SQL statements run while serving the current request, with their duration in milliseconds
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.statements)
+
+    def slowest(self, limit):
+        return sorted(self.statements, key=lambda statement: statement[1], reverse=True)[:limit]
+
+    def repeated(self, threshold):
+        """
+        Statements run at least `threshold` times, the usual sign of an N+1 (e.g. a lazy relationship in a loop)
+        """
+        counts = collections.Counter(statement for statement, _ in self.statements)
+        return [(statement, count) for statement, count in counts.most_common() if count >= threshold]
+
+    def summary(self, slowest, repeated_threshold):
+        lines = ['{} {}: {} queries in {:.2f} ms'.format(request.method, request.path, self.count, self.duration)]
+        lines.extend('  {:.2f} ms {}'.format(duration, ' '.join(statement.split()))
+                     for statement, duration in self.slowest(slowest))
+        lines.extend('  possible N+1, run {} times: {}'.format(count, ' '.join(statement.split()))
+                     for statement, count in self.repeated(repeated_threshold))
+        return '\n'.join(lines)
+
+
+def init_instrumentation(app):
+    """
+    Opt-in (SQL_INSTRUMENTATION) per request SQL instrumentation. Every response gets a Server-Timing header with the
+    query count and database time, in debug mode a summary with the slowest statements and possible N+1s is logged,
+    and views running more queries than their SQL_QUERY_BUDGETS entry are logged, or fail with QueryBudgetExceeded if
+    SQL_QUERY_BUDGET_STRICT is set (as the tests do)
+    """
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_log' in g:
+            conn.info.setdefault('query_start', []).append(default_timer())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_log' in g and conn.info.get('query_start'):
+            duration = (default_timer() - conn.info['query_start'].pop()) * 1000
+            g.query_log.statements.append((statement, duration))
+
+    @app.before_request
+    def start_query_log():
+        if app.config['SQL_INSTRUMENTATION']:
+            g.query_log = QueryLog()
+
+    @app.after_request
+    def report_query_log(response):
+        query_log = g.pop('query_log', None)
+        if query_log is None:
+            return response
+        response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(
+            query_log.duration, query_log.count))
+        if app.debug:
+            app.logger.debug(query_log.summary(app.config['SQL_SLOWEST_STATEMENTS'],
+                                               app.config['SQL_REPEATED_THRESHOLD']))
+        budget = app.config['SQL_QUERY_BUDGETS'].get(request.endpoint)
+        if budget is not None and query_log.count > budget:
+            message = '{} ran {} queries, its budget is {}\n{}'.format(
+                request.endpoint, query_log.count, budget,
+                query_log.summary(app.config['SQL_SLOWEST_STATEMENTS'], app.config['SQL_REPEATED_THRESHOLD']))
+            if app.config['SQL_QUERY_BUDGET_STRICT']:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
@@ -0,0 +1,171 @@
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from alayatodo import app, db
+from alayatodo.feed import change_feed
+from alayatodo.models import (ArchivedTodo, Job, Todo, TodoTombstone, current_todos_version, log_todo_change,
+                              todos_changed)
+
+JOB_KINDS = ('complete_all', 'delete_completed', 'import')
+
+jobs = Job.__table__
+todos = Todo.__table__
+tombstones = TodoTombstone.__table__
+archived_todos = ArchivedTodo.__table__
+
+
+class JobQueue(object):
+    """
+    Runs the bulk operations of the job table in a pool of `workers` threads of this process. A job is claimed with a
+    conditional UPDATE before it runs, so it never runs twice at once, and resume() picks up the jobs of processes that
+    died, once they stop sending heartbeats for `lease` seconds. Jobs work through `chunk_size` todos at a time, each
+    chunk a few set based statements committed together with the job's progress, so no transaction is ever long and an
+    interrupted job carries on where it stopped. With no workers jobs run on the calling thread
+    """
+
+    def __init__(self, workers, chunk_size, lease):
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+
+    def submit(self, job_id):
+        if self._executor is None:
+            self.run(job_id)
+        else:
+            self._executor.submit(self._run_in_context, job_id)
+
+    def resume(self):
+        """
+        Submits the jobs waiting to run, e.g. after a restart
+        """
+        stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease)
+        ids = [job_id for job_id, in db.engine.execute(db.select([jobs.c.id]).where(db.or_(
+            jobs.c.status == 'queued', db.and_(jobs.c.status == 'running', jobs.c.updated_at < stale))))]
+        for job_id in ids:
+            self.submit(job_id)
+        return ids
+
+    def run(self, job_id):
+        if not self._claim(job_id):
+            return
+        job = db.engine.execute(jobs.select().where(jobs.c.id == job_id)).first()
+        try:
+            getattr(self, '_{}'.format(job.kind))(job)
+        except Exception as error:
+            app.logger.exception('Job %s failed', job_id)
+            self._finish(job, 'failed', str(error)[:255])
+        else:
+            self._finish(job, 'done')
+
+    def _run_in_context(self, job_id):
+        with app.app_context():
+            self.run(job_id)
+
+    def _claim(self, job_id):
+        now = datetime.datetime.utcnow()
+        stale = now - datetime.timedelta(seconds=self.lease)
+        result = db.engine.execute(jobs.update().where(db.and_(jobs.c.id == job_id, db.or_(
+            jobs.c.status == 'queued', db.and_(jobs.c.status == 'running', jobs.c.updated_at < stale))))
+                                   .values(status='running', updated_at=now))
+        return result.rowcount == 1
+
+    def _progress(self, connection, job_id, processed):
+        connection.execute(jobs.update().where(jobs.c.id == job_id).values(
+            processed=jobs.c.processed + processed, updated_at=datetime.datetime.utcnow()))
+
+    def _finish(self, job, status, error=None):
+        with db.engine.begin() as connection:
+            connection.execute(jobs.update().where(jobs.c.id == job.id).values(
+                status=status, error=error, updated_at=datetime.datetime.utcnow()))
+            # a single entry for the whole job, the change feed tells clients to load their list again
+            log_todo_change(connection, job.user_id, 'reset')
+        change_feed.notify()
+
+    def _chunks(self, job, select_ids, change):
+        """
+        Applies `change` to the ids returned by `select_ids`, a chunk at a time, until there are none left
+        """
+        while True:
+            with db.engine.begin() as connection:
+                ids = [todo_id for todo_id, in connection.execute(select_ids.limit(self.chunk_size))]
+                if not ids:
+                    return
+                change(connection, ids)
+                self._progress(connection, job.id, len(ids))
+
+    # like the ORM listeners of alayatodo.models, every chunk bumps the todos version before stamping its rows with it
+    def _complete_all(self, job):
+        def complete(connection, ids):
+            todos_changed(connection, job.user_id, 0, -len(ids))
+            connection.execute(todos.update().where(todos.c.id.in_(ids)).values(
+                completed=True, completed_at=datetime.datetime.utcnow(),
+                version=current_todos_version(job.user_id)))
+
+        self._chunks(job, db.select([todos.c.id]).where(db.and_(
+            todos.c.user_id == job.user_id, todos.c.completed == False)), complete)
+
+    def _delete_completed(self, job):
+        def deleter(table):
+            def delete(connection, ids):
+                todos_changed(connection, job.user_id, -len(ids), 0)
+                connection.execute(tombstones.insert().from_select(
+                    ['todo_id', 'user_id', 'version'],
+                    db.select([table.c.id, table.c.user_id, current_todos_version(job.user_id)])
+                    .where(table.c.id.in_(ids))))
+                connection.execute(table.delete().where(table.c.id.in_(ids)))
+
+            return delete
+
+        self._chunks(job, db.select([todos.c.id]).where(db.and_(
+            todos.c.user_id == job.user_id, todos.c.completed == True)), deleter(todos))
+        # archived todos are all completed
+        self._chunks(job, db.select([archived_todos.c.id]).where(archived_todos.c.user_id == job.user_id),
+                     deleter(archived_todos))
+
+    def _import(self, job):
+        descriptions = json.loads(job.payload)['descriptions']
+        # descriptions before `processed` were committed by an earlier, interrupted run
+        for start in range(job.processed, len(descriptions), self.chunk_size):
+            chunk = descriptions[start:start + self.chunk_size]
+            with db.engine.begin() as connection:
+                todos_changed(connection, job.user_id, len(chunk), len(chunk))
+                connection.execute(todos.insert().values(version=current_todos_version(job.user_id)),
+                                   [{'user_id': job.user_id, 'description': description, 'completed': False}
+                                    for description in chunk])
+                self._progress(connection, job.id, len(chunk))
+
+
+def invalid_import(descriptions):
+    """
+    Why `descriptions` cannot be imported, if they cannot
+    """
+    if not isinstance(descriptions, list) or not descriptions:
+        return 'Expected a non empty list of descriptions.'
+    if len(descriptions) > app.config['JOB_IMPORT_LIMIT']:
+        return 'Imports cannot have more than {} todos.'.format(app.config['JOB_IMPORT_LIMIT'])
+    if not all(isinstance(description, type(u'')) and description.strip() and len(description) <= 255
+               for description in descriptions):
+        return 'Descriptions must be non empty strings of at most 255 characters.'
+
+
+def queue_job(user_id, kind, payload=None):
+    """
+    Saves a job and hands it to the job queue once it is committed
+    """
+    job = Job(user_id=user_id, kind=kind, payload=json.dumps(payload) if payload is not None else None)
+    db.session.add(job)
+    db.session.flush()
+    job_id = job.id
+    db.session.commit()
+    job_queue.submit(job_id)
+    return job_id
+
+
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_CHUNK_SIZE'], app.config['JOB_LEASE_SECONDS'])
+
+
+@app.before_first_request
+def resume_jobs():
+    # here rather than at import time, so every forked worker starts its own threads
+    job_queue.resume()
@@ -1,14 +1,23 @@
+import datetime
+
 from marshmallow_sqlalchemy import ModelSchema
+from sqlalchemy import event
 from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from alayatodo import db
+from alayatodo import app, db
+from alayatodo.security import needs_rehash
 
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(255), nullable=False, unique=True)
     password_hash = db.Column(db.String(255), nullable=False)
+    todos_count = db.Column(db.Integer, nullable=False, server_default='0')
+    open_todos_count = db.Column(db.Integer, nullable=False, server_default='0')
+    show_completed = db.Column(db.Boolean, nullable=False, server_default='0')
+    # bumped on every change to the user's todos, the ETags of the todo views are derived from it
+    todos_version = db.Column(db.Integer, nullable=False, server_default='0')
     todos = db.relationship('Todo', backref='user', lazy='dynamic')
 
     def __init__(self, username, password):
@@ -27,24 +36,56 @@ class User(db.Model):
         return field
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, app.config['PASSWORD_HASH_METHOD'])
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash, app.config['PASSWORD_HASH_METHOD'])
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    def count_todos(self, show_completed):
+        return self.todos_count if show_completed else self.open_todos_count
+
+    @staticmethod
+    def recount_todos():
+        """
+        Rebuilds todos_count and open_todos_count from the todo table, for rows written without going through the ORM
+        """
+        # archived todos are still the user's, and still counted
+        total = db.select([db.func.count(Todo.id)]).where(Todo.user_id == User.id).as_scalar() + \
+            db.select([db.func.count(ArchivedTodo.id)]).where(ArchivedTodo.user_id == User.id).as_scalar()
+        open_todos = db.select([db.func.count(Todo.id)]).where(
+            db.and_(Todo.user_id == User.id, Todo.completed == False)).as_scalar()
+        db.session.query(User).update({User.todos_count: total, User.open_todos_count: open_todos,
+                                       User.todos_version: User.todos_version + 1}, synchronize_session=False)
+
 
 class Todo(db.Model):
+    __table_args__ = (
+        db.Index('ix_todo_user_id_completed_id', 'user_id', 'completed', db.text('id DESC')),
+        db.Index('ix_todo_user_id_version', 'user_id', 'version'),
+        db.Index('ix_todo_completed_at', 'completed_at'),
+        # ids are never reused on SQLite either, tombstones, the change log and the archive refer to them
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.String(255), nullable=False)
-    completed = db.Column(db.Boolean, nullable=False, server_default='0')
+    # active history keeps the previous value around on assignment, which the todo counters below rely on
+    completed = db.column_property(db.Column(db.Boolean, nullable=False, server_default='0'), active_history=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # todos version of the user when the todo last changed, see alayatodo.sync
+    version = db.Column(db.Integer, nullable=False, server_default='0')
+    # when the todo was last completed, alayatodo.archive moves it to the archive some time after
+    completed_at = db.Column(db.DateTime)
+    archived = False
 
     def __repr__(self):
         return '<Todo {}>'.format(self.description)
 
     def as_dict(self):
-        todo_schema = TodoSchema()
-        return todo_schema.dump(self).data
+        return serialize_todos([self])[0]
 
     @validates('description')
     def validates_presence(self, _, field):
@@ -58,6 +99,211 @@ class Todo(db.Model):
         return user
 
 
+class ArchivedTodo(db.Model):
+    """
+    Completed todo moved out of the todo table by alayatodo.archive, so it no longer weighs on the queries of the todo
+    list. It keeps its id, and still counts in the todos_count of its user
+    """
+    __tablename__ = 'todo_archive'
+    __table_args__ = (
+        db.Index('ix_todo_archive_user_id_id', 'user_id', 'id'),
+        db.Index('ix_todo_archive_user_id_version', 'user_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(255), nullable=False)
+    completed = db.Column(db.Boolean, nullable=False, server_default='1')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default='0')
+    completed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    archived = True
+
+    def __repr__(self):
+        return '<ArchivedTodo {}>'.format(self.description)
+
+
+class Job(db.Model):
+    """
+    Bulk operation on the todos of a user, run in the background by alayatodo.jobs
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    # JSON arguments of the job, e.g. the descriptions of an import
+    payload = db.Column(db.Text)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # heartbeat of the job while it runs, see JobQueue.resume
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return '<Job {} {}>'.format(self.kind, self.status)
+
+    def as_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'status': self.status, 'processed': self.processed,
+                'error': self.error, 'created_at': self.created_at.isoformat() + 'Z'}
+
+
+class TodoChange(db.Model):
+    """
+    Entry of the change log of the todos of a user, which the change feed (see alayatodo.feed) streams in id order.
+    Bulk changes log a single 'reset' entry with no todo, after which clients should load the list again
+    """
+    __table_args__ = (
+        db.Index('ix_todo_change_user_id_id', 'user_id', 'id'),
+        # pruned by age, see alayatodo.feed.prune_changes
+        db.Index('ix_todo_change_created_at', 'created_at'),
+        # ids are never reused on SQLite either, so Last-Event-ID always points at the same change
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # no foreign key, deletions are logged too
+    todo_id = db.Column(db.Integer)
+    action = db.Column(db.String(16), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return '<TodoChange {} {}>'.format(self.action, self.todo_id)
+
+
+class TodoTombstone(db.Model):
+    """
+    Todo deleted at `version`, kept so the clients syncing with /api/todos/changes hear about it
+    """
+    __table_args__ = (
+        db.Index('ix_todo_tombstone_user_id_version', 'user_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # no foreign key, the todo is gone
+    todo_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<TodoTombstone {} {}>'.format(self.todo_id, self.version)
+
+
 class TodoSchema(ModelSchema):
     class Meta:
         model = Todo
+        exclude = ('version', 'completed_at')
+
+
+# Columns serialize_todos needs, for queries that want plain row tuples instead of Todo instances
+TODO_COLUMNS = (Todo.id, Todo.description, Todo.completed, Todo.user_id)
+ARCHIVED_TODO_COLUMNS = (ArchivedTodo.id, ArchivedTodo.description, ArchivedTodo.completed, ArchivedTodo.user_id)
+TODO_FIELDS = tuple(sorted(TodoSchema().fields))
+
+
+def serialize_todos(rows):
+    """
+    Dumps todos the same way TodoSchema does, without building a schema or touching the user relationship for every row.
+    Rows can be Todo instances or tuples queried with TODO_COLUMNS, which skips ORM object hydration altogether
+    """
+    return [{'id': row.id, 'description': row.description, 'completed': row.completed, 'user': row.user_id}
+            for row in rows]
+
+
+def todos_changed(connection, user_id, total=0, open_todos=0):
+    """
+    Bumps the todos version of a user and applies a delta to their todo counters, relative to the stored values so
+    concurrent writers do not race
+    """
+    if user_id is None:
+        return
+    table = User.__table__
+    connection.execute(table.update().where(table.c.id == user_id).values(
+        todos_count=table.c.todos_count + total,
+        open_todos_count=table.c.open_todos_count + open_todos,
+        todos_version=table.c.todos_version + 1))
+
+
+def current_todos_version(user_id):
+    """
+    SQL expression of the todos version of a user, which stamps the rows written after todos_changed bumped it. The bump
+    locks the user row until the transaction ends, so concurrent writers of the same user never share a version
+    """
+    table = User.__table__
+    return db.select([table.c.todos_version]).where(table.c.id == user_id).as_scalar()
+
+
+def log_todo_change(connection, user_id, action, todo_id=None):
+    """
+    Adds an entry to the change log of a user, see TodoChange
+    """
+    if user_id is None:
+        return
+    connection.execute(TodoChange.__table__.insert().values(
+        user_id=user_id, todo_id=todo_id, action=action, created_at=datetime.datetime.utcnow()))
+
+
+def _log_change(connection, todo, action):
+    log_todo_change(connection, todo.user_id, action, todo.id)
+    # tells the change feed there is something new once the session commits
+    db.inspect(todo).session.info['todo_changes'] = True
+
+
+# The counters, versions, tombstones and change log are maintained from the flush, so every ORM write keeps them in the
+# same transaction as the todo itself. The todos version is bumped before the row is written, so the row can be stamped
+# with it
+@event.listens_for(Todo, 'before_insert')
+def _count_inserted_todo(mapper, connection, todo):
+    # completed is not loaded when it was left to its server default (not completed), reading it would run a query
+    completed = db.inspect(todo).dict.get('completed', False)
+    todos_changed(connection, todo.user_id, 1, 0 if completed else 1)
+    if completed:
+        todo.completed_at = datetime.datetime.utcnow()
+    _stamp_version(todo)
+
+
+def _has_changes(mapper, todo):
+    state = db.inspect(todo)
+    return any(state.attrs[attribute.key].history.has_changes() for attribute in mapper.column_attrs)
+
+
+@event.listens_for(Todo, 'before_update')
+def _count_updated_todo(mapper, connection, todo):
+    if not _has_changes(mapper, todo):
+        return
+    history = db.inspect(todo).attrs.completed.history
+    if history.has_changes() and bool(history.deleted and history.deleted[0]) != bool(todo.completed):
+        todos_changed(connection, todo.user_id, 0, -1 if todo.completed else 1)
+        todo.completed_at = datetime.datetime.utcnow() if todo.completed else None
+    else:
+        todos_changed(connection, todo.user_id)
+    _stamp_version(todo)
+
+
+@event.listens_for(Todo, 'before_delete')
+def _count_deleted_todo(mapper, connection, todo):
+    todos_changed(connection, todo.user_id, -1, 0 if todo.completed else -1)
+    if todo.user_id is not None:
+        connection.execute(TodoTombstone.__table__.insert().values(
+            todo_id=todo.id, user_id=todo.user_id, version=current_todos_version(todo.user_id)))
+
+
+def _stamp_version(todo):
+    if todo.user_id is not None:
+        todo.version = current_todos_version(todo.user_id)
+
+
+@event.listens_for(Todo, 'after_insert')
+def _log_inserted_todo(mapper, connection, todo):
+    _log_change(connection, todo, 'created')
+
+
+@event.listens_for(Todo, 'after_update')
+def _log_updated_todo(mapper, connection, todo):
+    if _has_changes(mapper, todo):
+        _log_change(connection, todo, 'updated')
+
+
+@event.listens_for(Todo, 'after_delete')
+def _log_deleted_todo(mapper, connection, todo):
+    _log_change(connection, todo, 'deleted')
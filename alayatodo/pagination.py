@@ -0,0 +1,81 @@
+import base64
+import binascii
+
+from flask_sqlalchemy import Pagination
+
+from alayatodo.archive import with_archived_todos
+from alayatodo.models import ArchivedTodo, Todo
+
+
+def encode_cursor(todo):
+    """
+    Builds the opaque cursor pointing right after the given todo in the list ordering (completed ASC, id DESC)
+    """
+    raw = '{}:{}'.format(int(todo.completed), todo.id).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor, returning a (completed, id) tuple. Raises ValueError if the cursor was tampered with
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        completed, todo_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').split(':')
+        completed, todo_id = int(completed), int(todo_id)
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    if completed not in (0, 1):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    return bool(completed), todo_id
+
+
+class KeysetPagination(object):
+    """
+    Page of todos fetched with keyset (cursor) pagination. Unlike flask_sqlalchemy's Pagination it knows nothing about
+    the total number of rows, which is what makes every page as cheap as the first one
+    """
+
+    def __init__(self, items, per_page, next_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def paginate_todos(query, after, per_page, show_completed, user_id=None):
+    """
+    Fetches the page of todos following the `after` cursor (or the first page if it is empty) from a query already
+    filtered by user. Each boolean value of `completed` is read as its own range of the (user_id, completed, id) index,
+    so no query ever has to skip or sort the rows of previous pages. Given the `user_id` the query is filtered by, the
+    completed todos are read along with the archived ones
+    """
+    completed, last_id = decode_cursor(after) if after else (False, None)
+    items = []
+    for value in (False, True):
+        if value < completed or (value and not show_completed):
+            continue
+        rows = query.filter(Todo.completed == value)
+        after_last = value == completed and last_id is not None
+        if after_last:
+            rows = rows.filter(Todo.id < last_id)
+        if value and user_id is not None:
+            rows = with_archived_todos(rows, user_id, *([ArchivedTodo.id < last_id] if after_last else []))
+        # one extra row tells us whether there is a next page without counting
+        items.extend(rows.order_by(Todo.id.desc()).limit(per_page + 1 - len(items)).all())
+        if len(items) > per_page:
+            break
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return KeysetPagination(items[:per_page], per_page, next_cursor)
+
+
+def paginate_counted(query, page, per_page, total):
+    """
+    Same as Query.paginate, but with a total we already know (see User.todos_count) instead of running a COUNT(*)
+    """
+    page = max(page, 1)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    return Pagination(query, page, per_page, total, items)
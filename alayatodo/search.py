@@ -0,0 +1,73 @@
+from sqlalchemy import DDL, event
+from sqlalchemy.exc import OperationalError
+
+from alayatodo import db
+from alayatodo.models import Todo, TODO_COLUMNS
+
+# External content FTS5 index over todo, kept in sync by triggers so every write path (ORM, bulk seeder, API batches)
+# updates it. user_id is indexed too, so searching the todos of one user intersects two posting lists instead of
+# filtering the matches of every user. The same statements are run by the todo_search migration
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE todo_fts USING fts5(user_id, description, content='todo', content_rowid='id')",
+    "CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+    "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END",
+    "CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+    "VALUES ('delete', old.id, old.user_id, old.description); END",
+    "CREATE TRIGGER todo_fts_update AFTER UPDATE OF user_id, description ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+    "VALUES ('delete', old.id, old.user_id, old.description); "
+    "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END",
+]
+
+todo_fts = db.table('todo_fts', db.column('rowid'))
+# database URL -> whether it has the FTS index, only ever set to False
+_fts_enabled = {}
+
+
+def _has_fts5(ddl, target, bind, **kwargs):
+    return bind.dialect.name == 'sqlite' and bind.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()
+
+
+for statement in FTS_DDL:
+    event.listen(Todo.__table__, 'after_create', DDL(statement).execute_if(callable_=_has_fts5))
+event.listen(Todo.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS todo_fts').execute_if(dialect='sqlite'))
+
+
+def match_expression(user_id, terms):
+    """
+    FTS5 query matching todos of `user_id` containing every term. Terms are quoted, so whatever the user typed is
+    searched for literally instead of being parsed as FTS5 syntax
+    """
+    phrases = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    return 'user_id:"{}" AND description:({})'.format(user_id, phrases)
+
+
+def search_todos(user_id, terms, page, per_page):
+    """
+    Todos of `user_id` whose description contains every term, best match first (BM25 over the description), as
+    TODO_COLUMNS rows. Returns a page of rows and whether there is a next page. Databases without the FTS index (not
+    SQLite, or SQLite without FTS5) fall back to a LIKE scan, newest first
+    """
+    query = db.session.query(*TODO_COLUMNS).filter(Todo.user_id == user_id)
+    engine = db.session.get_bind(mapper=db.inspect(Todo))
+    if engine.dialect.name == 'sqlite' and _fts_enabled.get(str(engine.url), True):
+        fts = db.literal_column('todo_fts')
+        try:
+            return _page(query.join(todo_fts, todo_fts.c.rowid == Todo.id)
+                         .filter(fts.op('MATCH')(match_expression(user_id, terms)))
+                         .order_by(db.func.bm25(fts, 0.0, 1.0), Todo.id.desc()), page, per_page)
+        except OperationalError as error:
+            if 'todo_fts' not in str(error):
+                raise
+            # SQLite without FTS5, remember it rather than failing once per search
+            _fts_enabled[str(engine.url)] = False
+    for term in terms:
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Todo.description.ilike('%{}%'.format(escaped), escape='\\'))
+    return _page(query.order_by(Todo.id.desc()), page, per_page)
+
+
+def _page(query, page, per_page):
+    rows = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+    return rows[:per_page], len(rows) > per_page
@@ -0,0 +1,154 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_stored_methods = {}
+
+
+class LoginUnavailable(Exception):
+    """
+    Raised when a login attempt is rejected before checking the password, because of throttling (429) or load (503)
+    """
+
+    def __init__(self, message, status):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def stored_method(method):
+    """
+    The method as it is recorded in the hashes it generates, e.g. 'pbkdf2:sha256' is stored with werkzeug's default
+    iteration count as 'pbkdf2:sha256:150000'
+    """
+    if method not in _stored_methods:
+        _stored_methods[method] = generate_password_hash('', method).split('$', 1)[0]
+    return _stored_methods[method]
+
+
+def needs_rehash(password_hash, method):
+    """
+    Whether `password_hash` was generated with other parameters than `method`
+    """
+    return password_hash.split('$', 1)[0] != stored_method(method)
+
+
+def _thread_pool(workers):
+    """
+    Hashing needs real OS threads. When serving with gevent (see alayatodo.serving) threading is patched to greenlets,
+    which would block every connection while hashing, so gevent's pool of OS threads is used instead
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(max_workers=workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+class PasswordVerifier(object):
+    """
+    Checks (and generates) password hashes in a pool of `workers` threads, so a burst of logins cannot have every
+    worker thread of the process burning CPU in PBKDF2 at once. At most `queue_size` checks wait for a free hashing
+    thread, and none of them waits longer than `timeout` seconds. With no workers hashes are checked on the calling
+    thread
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.timeout = timeout
+        self._executor = _thread_pool(workers) if workers else None
+        self._capacity = workers + queue_size
+        self._pending = 0
+        # a condition rather than a semaphore, whose acquire takes no timeout on Python 2
+        self._slots = threading.Condition()
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password, method):
+        return self._run(generate_password_hash, password, method)
+
+    def _run(self, function, *args):
+        if self._executor is None:
+            return function(*args)
+        deadline = time.time() + self.timeout
+        self._acquire(deadline)
+        try:
+            future = self._executor.submit(function, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0))
+        except TimeoutError:
+            future.cancel()
+            raise LoginUnavailable('Too many logins are being checked right now', 503)
+
+    def _acquire(self, deadline):
+        with self._slots:
+            while self._pending >= self._capacity:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise LoginUnavailable('Too many logins are being checked right now', 503)
+                self._slots.wait(remaining)
+            self._pending += 1
+
+    def _release(self):
+        with self._slots:
+            self._pending -= 1
+            self._slots.notify()
+
+
+class LoginThrottle(object):
+    """
+    Counts failed logins per username and IP address, and per IP address, over the last `window` seconds, so attempts
+    that would be rejected anyway do not cost a password hash. Usernames are counted along with the IP address so
+    failing logins from elsewhere cannot lock a user out; the limit per IP address still bounds how many passwords one
+    client can try. Limits set to None are not enforced. Only the `max_keys` most recently
+    failing keys are remembered, which bounds memory during a credential stuffing attack
+    """
+
+    def __init__(self, max_per_username, max_per_ip, window, max_keys=100000):
+        self.limits = {'username': max_per_username, 'ip': max_per_ip}
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, username, ip):
+        with self._lock:
+            for kind, key in (('username', (username, ip)), ('ip', ip)):
+                limit = self.limits[kind]
+                if limit is not None and len(self._recent((kind, key))) >= limit:
+                    raise LoginUnavailable('Too many failed logins for this {}'.format(kind), 429)
+
+    def failed(self, username, ip):
+        now = time.time()
+        with self._lock:
+            for key in (('username', (username, ip)), ('ip', ip)):
+                failures = self._recent(key)
+                failures.append(now)
+                # (re)inserting moves the key last, so the keys that have not failed for the longest go first
+                self._failures.pop(key, None)
+                self._failures[key] = failures
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, username, ip):
+        with self._lock:
+            self._failures.pop(('username', (username, ip)), None)
+
+    def reset(self):
+        with self._lock:
+            self._failures.clear()
+
+    def _recent(self, key):
+        failures = self._failures.get(key, collections.deque())
+        while failures and failures[0] < time.time() - self.window:
+            failures.popleft()
+        return failures
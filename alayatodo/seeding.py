@@ -0,0 +1,109 @@
+import datetime
+import itertools
+import random
+
+from faker import Faker
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash
+
+from alayatodo import app, db
+from alayatodo.models import User, Todo
+
+COMPLETED_RATIO = 0.3
+# users inserted, and looked up by username for their ids, at a time
+USER_BATCH_SIZE = 500
+
+
+def fake_users(users, todos_per_user, password=None):
+    """
+    Lazily generates users shaped like the entries of resources/seeds.json, todos included, so any amount of data can be
+    seeded without holding it in memory. Every user gets `password` if given, or a random one otherwise
+    """
+    fake = Faker()
+    for number in range(users):
+        yield {
+            # the number follows the last dot, so two users never end up with the same name
+            'username': '{}.{}'.format(fake.user_name(), number),
+            'password': password or fake.password(),
+            'todos': fake_todos(fake, todos_per_user),
+        }
+
+
+def fake_todos(fake, todos):
+    for _ in range(todos):
+        yield {'description': fake.sentence(nb_words=6)[:255], 'completed': random.random() < COMPLETED_RATIO}
+
+
+class BulkSeeder(object):
+    """
+    Inserts users and todos with Core executemany, writing and committing every `chunk_size` rows. Users go in a batch
+    at a time and their ids, assigned by the database so its sequences keep up, are read back by username before their
+    todos are written. When `password_hash` is given it is used for everybody, skipping the deliberately slow hashing of
+    every password
+    """
+
+    def __init__(self, chunk_size=10000, password_hash=None):
+        self.chunk_size = chunk_size
+        self.password_hash = password_hash
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.users = self.todos = 0
+        self._todo_rows, self._counts = [], []
+
+    def seed(self, users):
+        users = iter(users)
+        while True:
+            batch = list(itertools.islice(users, min(self.chunk_size, USER_BATCH_SIZE)))
+            if not batch:
+                return self.users, self.todos
+            ids = self.insert_users(batch)
+            # completed todos are archived ARCHIVE_AFTER_DAYS after being seeded, like the ones migrated
+            now = datetime.datetime.utcnow()
+            for user in batch:
+                user_id = ids[user['username']]
+                total = open_todos = 0
+                for todo in user.get('todos', []):
+                    completed = todo.get('completed', False)
+                    self._todo_rows.append({'user_id': user_id, 'description': todo['description'],
+                                            'completed': completed, 'completed_at': now if completed else None})
+                    total += 1
+                    open_todos += 0 if completed else 1
+                    if len(self._todo_rows) >= self.chunk_size:
+                        self.flush()
+                self._counts.append({'user_id': user_id, 'total': total, 'open': open_todos})
+            self.flush()
+
+    def insert_users(self, batch):
+        """
+        Inserts a batch of users, returning their ids by username
+        """
+        users = User.__table__
+        usernames = [user['username'] for user in batch]
+        with db.engine.begin() as connection:
+            connection.execute(users.insert(), [{
+                'username': user['username'],
+                'password_hash': self.password_hash or generate_password_hash(user['password'], self.method),
+            } for user in batch])
+            ids = dict((username, user_id) for user_id, username in connection.execute(
+                db.select([users.c.id, users.c.username]).where(users.c.username.in_(usernames))))
+        self.users += len(batch)
+        return ids
+
+    def flush(self):
+        users = User.__table__
+        with db.engine.begin() as connection:
+            if self._todo_rows:
+                connection.execute(Todo.__table__.insert(), self._todo_rows)
+            if self._counts:
+                connection.execute(users.update().where(users.c.id == bindparam('user_id')).values(
+                    todos_count=bindparam('total'), open_todos_count=bindparam('open')), self._counts)
+        self.todos += len(self._todo_rows)
+        self._todo_rows, self._counts = [], []
+
+
+def bulk_seed(users, chunk_size=10000, password=None):
+    """
+    Seeds an iterable of users (see fake_users) in chunks. `password`, if given, is hashed once and shared by every
+    user. Returns the number of users and todos inserted
+    """
+    password_hash = generate_password_hash(password, app.config['PASSWORD_HASH_METHOD']) if password else None
+    return BulkSeeder(chunk_size, password_hash).seed(users)
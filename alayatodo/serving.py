@@ -0,0 +1,69 @@
+from alayatodo import db
+
+
+def serve(app, host, port, workers, threads, connections=None):
+    """
+    Serves the app with gunicorn, without the debugger or the reloader. The app is loaded once and `workers` processes
+    are forked from it, sharing its memory pages until they write to them, each serving `threads` requests at a time.
+    With `connections` the workers are gevent ones, serving up to that many connections with a greenlet each, so views
+    waiting on the network or the database do not pin an OS thread each; the standard library must then have been
+    monkey patched before anything else was imported (see main.py). SQLite calls still block the worker while they run,
+    which the production profile keeps short
+    """
+    from gunicorn.app.base import BaseApplication
+
+    app.debug = False
+    # compiled templates are shared by the workers like the rest of the app
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+    options = {
+        'bind': '{}:{}'.format(host, port),
+        'workers': workers,
+        'threads': threads,
+        'preload_app': True,
+        'post_fork': lambda server, worker: dispose_engines(app),
+    }
+    if connections:
+        options.update({'worker_class': 'gevent', 'worker_connections': connections,
+                        'post_worker_init': lambda worker: make_psycopg2_cooperative()})
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def dispose_engines(app):
+    """
+    Drops the connections inherited from the parent process, a forked worker must open its own
+    """
+    with app.app_context():
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or {}):
+            db.get_engine(app, bind=bind).dispose()
+
+
+def make_psycopg2_cooperative():
+    try:
+        from psycopg2 import extensions, OperationalError
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def wait(connection, timeout=None):
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                break
+            elif state == extensions.POLL_READ:
+                wait_read(connection.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(connection.fileno(), timeout=timeout)
+            else:
+                raise OperationalError('Bad result from poll: {}'.format(state))
+
+    extensions.set_wait_callback(wait)
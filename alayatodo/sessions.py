@@ -0,0 +1,190 @@
+import base64
+import collections
+import errno
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """
+    Session whose data lives in a SessionStore, the cookie only carries its random id
+    """
+
+    def __init__(self, sid, data=None):
+        def on_update(_):
+            self.modified = True
+
+        CallbackDict.__init__(self, data, on_update)
+        self.sid = sid
+        self.modified = False
+
+    def regenerate(self):
+        """
+        Moves the session to a new id, e.g. on login so an id planted before logging in cannot be reused
+        """
+        self.previous_sid = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+def new_session_id():
+    return base64.urlsafe_b64encode(os.urandom(24)).decode('ascii')
+
+
+class MemoryStore(object):
+    """
+    Keeps the `max_entries` most recently used sessions of this process in memory
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.pop(sid, None)
+            if entry is None or entry[1] < time.time():
+                return None
+            self._sessions[sid] = entry
+            return entry[0]
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._sessions.pop(sid, None)
+            self._sessions[sid] = (data, expires)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class SqliteStore(object):
+    """
+    Keeps sessions in a SQLite file, so they are shared by every process of the host and survive restarts. Every thread
+    gets its own connection, and expired sessions are purged every `purge_every` saves. Whoever can write the file can
+    log in as anybody, so it is made readable by the app's user only, and refused if someone else owns it. Without
+    a path it goes in a directory of the temporary directory private to that user, see private_sessions_path
+    """
+
+    def __init__(self, path=None, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._saves = 0
+        self._local = threading.local()
+
+    def load(self, sid):
+        row = self._connection().execute('SELECT data FROM session WHERE id = ? AND expires >= ?',
+                                         (sid, time.time())).fetchone()
+        return row[0] if row is not None else None
+
+    def save(self, sid, data, expires):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO session (id, data, expires) VALUES (?, ?, ?)', (sid, data, expires))
+        self._saves += 1
+        if self._saves % self.purge_every == 0:
+            connection.execute('DELETE FROM session WHERE expires < ?', (time.time(),))
+
+    def delete(self, sid):
+        self._connection().execute('DELETE FROM session WHERE id = ?', (sid,))
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path is None:
+                self.path = private_sessions_path()
+            # not following symbolic links, which would let another user pick the file
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600))
+            _make_private(self.path, stat.S_ISREG, 0o600)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS session '
+                               '(id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+            self._local.connection = connection
+        return connection
+
+
+def private_sessions_path():
+    """
+    sessions.db in a directory of the temporary directory only the user running the app can use, the way Jinja picks the
+    directory of its bytecode cache
+    """
+    directory = os.path.join(tempfile.gettempdir(), 'alayatodo-sessions-{}'.format(os.getuid()))
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    _make_private(directory, stat.S_ISDIR, 0o700)
+    return os.path.join(directory, 'sessions.db')
+
+
+def _make_private(path, is_type, mode):
+    status = os.lstat(path)
+    if not is_type(status.st_mode) or status.st_uid != os.getuid():
+        raise RuntimeError('{} is not owned by the user running the app'.format(path))
+    if status.st_mode & 0o077:
+        os.chmod(path, mode)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Stores sessions server side in `store`, anything with load(sid), save(sid, data, expires) and delete(sid) methods
+    working on serialized session data, e.g. a Redis backed one. Sessions are only written when they change
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        data = self.store.load(sid) if sid else None
+        if data is None:
+            return ServerSideSession(new_session_id())
+        return ServerSideSession(sid, self.serializer.loads(data))
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        previous_sid = getattr(session, 'previous_sid', None)
+        if previous_sid is not None:
+            self.store.delete(previous_sid)
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.store.save(session.sid, self.serializer.dumps(dict(session)),
+                        time.time() + app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(app.session_cookie_name, session.sid, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app))
+
+
+def init_sessions(app):
+    """
+    Replaces Flask's signed cookie sessions with server side ones, kept in memory or in a SQLite file depending on
+    SESSION_STORE
+    """
+    if app.config['SESSION_STORE'] == 'memory':
+        store = MemoryStore(app.config['SESSION_MAX_ENTRIES'])
+    elif app.config['SESSION_STORE'] == 'sqlite':
+        store = SqliteStore(app.config['SESSION_SQLITE_PATH'])
+    else:
+        raise ValueError('Unknown session store {}'.format(app.config['SESSION_STORE']))
+    app.session_interface = ServerSideSessionInterface(store)
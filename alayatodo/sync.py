@@ -0,0 +1,68 @@
+import base64
+import binascii
+
+from alayatodo import db
+from alayatodo.models import ArchivedTodo, Todo, TodoTombstone, User
+
+todos = Todo.__table__
+archived_todos = ArchivedTodo.__table__
+tombstones = TodoTombstone.__table__
+
+
+def encode_sync_cursor(row):
+    """
+    Opaque cursor pointing right after a row of todo_changes, in their (version, deleted, id) order
+    """
+    raw = '{}:{}:{}'.format(row.version, int(row.deleted), row.id).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_sync_cursor(cursor):
+    """
+    Reverses encode_sync_cursor, returning a (version, deleted, id) tuple. Raises ValueError if it was tampered with
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+        parts = tuple(int(part) for part in raw.split(':'))
+    except (TypeError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    if len(parts) != 3 or parts[1] not in (0, 1):
+        raise ValueError('Invalid cursor {}'.format(cursor))
+    return parts
+
+
+def todos_version(user_id):
+    return db.session.query(User.todos_version).filter(User.id == user_id).scalar()
+
+
+def todo_changes(user_id, since, after, limit):
+    """
+    Todos of `user_id` changed after the todos version `since`, archived ones included, and tombstones of the ones
+    deleted since, in version order. All are read through their (user_id, version) index, so a sync costs what changed
+    rather than the size of the list; without `since` every todo is returned, and no tombstones. A tombstone is left out
+    while a todo with its id exists, ids reused before they were made strictly increasing would otherwise be both listed
+    and deleted. Returns up to `limit` rows, following the `after` cursor, and the cursor of the next page if any
+    """
+    live = db.select([todos.c.id, todos.c.description, todos.c.completed, todos.c.user_id, todos.c.version,
+                      db.literal_column('0').label('deleted')]).where(todos.c.user_id == user_id)
+    archived = db.select([archived_todos.c.id, archived_todos.c.description, archived_todos.c.completed,
+                          archived_todos.c.user_id, archived_todos.c.version,
+                          db.literal_column('0').label('deleted')]).where(archived_todos.c.user_id == user_id)
+    if since is None:
+        changed = db.union_all(live, archived)
+    else:
+        changed = db.union_all(
+            live.where(todos.c.version > since),
+            archived.where(archived_todos.c.version > since),
+            db.select([tombstones.c.todo_id, db.null().label('description'), db.null().label('completed'),
+                       tombstones.c.user_id, tombstones.c.version, db.literal_column('1').label('deleted')])
+            .where(db.and_(tombstones.c.user_id == user_id, tombstones.c.version > since,
+                           ~db.exists().where(todos.c.id == tombstones.c.todo_id))))
+    changed = changed.alias('changed')
+    query = db.select([changed]).order_by(changed.c.version, changed.c.deleted, changed.c.id).limit(limit + 1)
+    if after:
+        query = query.where(db.tuple_(changed.c.version, changed.c.deleted, changed.c.id) > decode_sync_cursor(after))
+    rows = db.session.execute(query).fetchall()
+    next_cursor = encode_sync_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
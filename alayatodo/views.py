@@ -1,19 +1,39 @@
+import datetime
 import functools
-import json
+import hashlib
+import os
+import time
 
 from flask import (
+    abort,
     redirect,
     render_template,
     request,
     session,
     flash,
+    get_template_attribute,
     jsonify,
-    url_for,
-    make_response
+    make_response,
+    url_for
 )
+from flask_wtf.csrf import generate_csrf
 
 from alayatodo import app, db
-from alayatodo.models import User, Todo
+from alayatodo.archive import delete_archived_todo, find_todo, with_archived_todos
+from alayatodo.cache import LRUCache
+from alayatodo.database import read_only
+from alayatodo.jobs import queue_job
+from alayatodo.models import User, Todo, serialize_todos
+from alayatodo.pagination import paginate_todos, paginate_counted
+from alayatodo.security import PasswordVerifier, LoginThrottle, LoginUnavailable
+
+password_verifier = PasswordVerifier(app.config['LOGIN_HASH_WORKERS'], app.config['LOGIN_HASH_QUEUE_SIZE'],
+                                     app.config['LOGIN_HASH_TIMEOUT'])
+login_throttle = LoginThrottle(app.config['LOGIN_MAX_FAILURES_PER_USERNAME'], app.config['LOGIN_MAX_FAILURES_PER_IP'],
+                               app.config['LOGIN_FAILURE_WINDOW'])
+# rendered home pages by README modification time and username, call home_cache.clear() to drop them
+home_cache = LRUCache(app.config['HOME_CACHE_SIZE'])
+README = os.path.join(app.root_path, os.pardir, 'README.md')
 
 
 def require_login(function):
@@ -32,11 +52,90 @@ def require_login(function):
     return wrapper
 
 
+def revalidate(response):
+    """
+    The pages show who is logged in, so browsers may keep them but must revalidate them
+    """
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def wants_fragment():
+    """
+    Requests sent by the scripts of the todo list, which update the page in place with the changed part of it instead of
+    following a redirect to a whole new page. Without JavaScript the forms are plain posts answered with redirects
+    """
+    return request.headers.get('X-Fragment') == '1'
+
+
+def render_todo_row(todo):
+    return get_template_attribute('macros.html', 'todo_row')(todo, generate_csrf())
+
+
+def todos_version():
+    return db.session.query(User.todos_version).filter(User.id == session['user_id']).scalar()
+
+
+def todos_etag(version, *parts):
+    """
+    Strong ETag of a todo view of the logged in user, from the version of their todos and whatever else the response
+    depends on
+    """
+    key = (session['user_id'], version) + parts
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def page_etag(version, *parts):
+    """
+    ETag of an HTML todo page, which also depends on the username in the session and on the CSRF token of its forms.
+    Pages are revalidated at least twice per CSRF token lifetime so the forms of a page served from the browser cache
+    never expire. Pages showing flash messages are one-off, and get no ETag
+    """
+    if '_flashes' in session:
+        return None
+    generate_csrf()  # makes sure the session holds the raw token the forms will be signed from
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    period = int(time.time() // (time_limit / 2.0)) if time_limit else 0
+    return todos_etag(version, session.get('username'),
+                      session.get(app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')), period, *parts)
+
+
+def conditional(etag, render):
+    """
+    Answers 304 Not Modified, without calling `render`, when the client already has the `etag` version of the response
+    """
+    if etag is not None and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    if etag is not None and response.status_code in (200, 304):
+        response.set_etag(etag)
+    return revalidate(response)
+
+
+def render_home():
+    with open(README, 'rb') as f:
+        return render_template('index.html', readme=f.read().decode('utf-8'))
+
+
 @app.route('/')
 def home():
-    with app.open_resource('../README.md', mode='r') as f:
-        readme = "".join(l.decode('utf-8') for l in f)
-        return render_template('index.html', readme=readme)
+    if '_flashes' in session:
+        # one-off messages, not worth caching
+        return render_home()
+    modified = os.stat(README).st_mtime
+    key = (modified, session.get('username'))
+    page = home_cache.get(key)
+    if page is None:
+        body = render_home()
+        page = home_cache.set(key, (body, hashlib.sha1(body.encode('utf-8')).hexdigest()))
+    body, etag = page
+    response = make_response(body)
+    response.set_etag(etag)
+    response.last_modified = datetime.datetime.utcfromtimestamp(int(modified))
+    return revalidate(response).make_conditional(request)
 
 
 @app.route('/login', methods=['GET'])
@@ -50,10 +149,26 @@ def login():
 def login_post():
     username = request.form.get('username')
     password = request.form.get('password')
-    user = User.query.filter_by(username=username).first()
-    if user is None or not user.check_password(password):
+    try:
+        login_throttle.check(username, request.remote_addr)
+        user = User.query.filter_by(username=username).first()
+        valid = user is not None and password_verifier.verify(user.password_hash, password)
+    except LoginUnavailable as error:
+        flash('Too many login attempts, please try again later', 'danger')
+        return render_template('login.html'), error.status
+    if not valid:
+        login_throttle.failed(username, request.remote_addr)
         flash('Invalid username or password', 'danger')
         return redirect(url_for('login'))
+    login_throttle.succeeded(username, request.remote_addr)
+    session.regenerate()
+    if user.password_needs_rehash():
+        try:
+            user.password_hash = password_verifier.hash(password, app.config['PASSWORD_HASH_METHOD'])
+            db.session.commit()
+        except LoginUnavailable:
+            # the login is valid anyway, the hash will be upgraded next time
+            pass
     session['username'] = user.username
     session['user_id'] = user.id
     flash('Successful login', 'success')
@@ -62,61 +177,114 @@ def login_post():
 
 @app.route('/logout')
 def logout():
-    if 'user_id' in session:
+    logged_in = 'user_id' in session
+    session.clear()
+    session.regenerate()
+    if logged_in:
         flash('You were logged out', 'danger')
-    session.pop('username', None)
-    session.pop('user_id', None)
     return redirect(url_for('home'))
 
 
 @app.route('/todo/<int:todo_id>', methods=['GET'])
 @require_login
+@read_only
 def todo(todo_id):
-    todo = db.session.query(Todo).filter(Todo.id == todo_id, Todo.user_id == session['user_id']).first_or_404()
-    return render_template('todo.html', todo=todo)
+    def render():
+        todo = find_todo(session['user_id'], todo_id)
+        if todo is None:
+            abort(404)
+        return render_template('todo.html', todo=todo)
+
+    return conditional(page_etag(todos_version(), todo_id), render)
 
 
 @app.route('/todo/', methods=['GET'])
 @require_login
+@read_only
 def todos():
     page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', app.config['TODOS_PER_PAGE'], type=int)
-    show_completed_cookie = request.cookies.get('show_completed')
-    user_showing = False
-    user_id = session.get('user_id')
-    if show_completed_cookie is not None:
-        show_completed_cookie = json.loads(show_completed_cookie)
-        user_showing = user_id in show_completed_cookie
-    todos = db.session.query(Todo).filter(Todo.user_id == user_id).order_by(Todo.completed.asc(), Todo.id.desc())
-    if not user_showing:
-        todos = todos.filter(Todo.completed != True)
-    todos = todos.paginate(page, per_page, False)
-    return render_template('todos.html', todos=todos, per_page=per_page, show_completed=user_showing)
+    per_page = todos_per_page(request.args)
+    after = request.args.get('after')
+    user = User.query.get_or_404(session.get('user_id'))
+
+    def render():
+        return render_todo_list('todos.html', user, page, per_page, after, job_id=session.get('job_id'))
+
+    return conditional(page_etag(user.todos_version, user.show_completed, page, per_page, after, session.get('job_id')),
+                       render)
+
+
+def todos_per_page(values):
+    return min(max(values.get('per_page', app.config['TODOS_PER_PAGE'], type=int), 1),
+               app.config['TODOS_PER_PAGE_LIMIT'])
+
+
+def render_todo_list(template, user, page, per_page, after=None, **context):
+    """
+    Renders a page of the todo list of `user`, whole (todos.html) or just the list itself (todo_list.html)
+    """
+    user_showing = user.show_completed
+    todos = db.session.query(Todo).filter(Todo.user_id == user.id)
+    if after is not None:
+        try:
+            todos = paginate_todos(todos, after, per_page, user_showing, user.id)
+        except ValueError:
+            # same as /api/todos
+            abort(400)
+    else:
+        if user_showing:
+            todos = with_archived_todos(todos, user.id)
+        else:
+            todos = todos.filter(Todo.completed == False)
+        total = user.count_todos(user_showing)
+        todos = paginate_counted(todos.order_by(Todo.completed.asc(), Todo.id.desc()), page, per_page, total)
+    return render_template(template, todos=todos, per_page=per_page, show_completed=user_showing,
+                           keyset=after is not None, **context)
 
 
 @app.route('/todo/', methods=['POST'])
 @require_login
 def todos_post():
     try:
-        todo = Todo(description=request.form.get('description', ''), user_id=session['user_id'])
-        db.session.add(todo)
-        db.session.commit()
-        flash('Todo was successfully created', 'success')
+        todo = Todo(description=request.form.get('description', ''), user_id=session['user_id'], completed=False)
     except AssertionError:
-        db.session.rollback()
-        flash('Todo description cannot be empty', 'danger')
+        message = 'Todo description cannot be empty'
+        if wants_fragment():
+            return jsonify({'status': 400, 'message': message}), 400
+        flash(message, 'danger')
+        return redirect(url_for('todos'))
+    db.session.add(todo)
+    db.session.flush()
+    message = 'Todo was successfully created'
+    fragment = None
+    if wants_fragment():
+        # built before the commit expires the todo, which would take another query to reload
+        fragment = {'status': 201, 'message': message, 'todo': todo.as_dict(), 'html': render_todo_row(todo)}
+    db.session.commit()
+    if fragment:
+        return jsonify(fragment), 201
+    flash(message, 'success')
     return redirect(url_for('todos'))
 
 
 @app.route('/todo/<int:todo_id>', methods=['POST'])
 @require_login
 def todo_update(todo_id):
-    todo = db.session.query(Todo).filter(Todo.id == todo_id, Todo.user_id == session['user_id']).first_or_404()
+    # the preference comes along, it decides whether the row stays on the list
+    todo, user_showing = db.session.query(Todo, User.show_completed).join(User, Todo.user_id == User.id) \
+        .filter(Todo.id == todo_id, Todo.user_id == session['user_id']).first_or_404()
     completed = request.form.get('completed') is not None
     todo.completed = completed
-    flash('Todo has been marked as {}completed.'.format('' if completed else 'not '), 'success')
-    db.session.add(todo)
+    message = 'Todo has been marked as {}completed.'.format('' if completed else 'not ')
+    fragment = None
+    if wants_fragment():
+        # no row when completing the todo takes it off the list
+        row = render_todo_row(todo) if user_showing or not completed else ''
+        fragment = {'status': 200, 'message': message, 'todo': todo.as_dict(), 'html': row}
     db.session.commit()
+    if fragment:
+        return jsonify(fragment)
+    flash(message, 'success')
     return redirect(url_for('todos'))
 
 
@@ -126,48 +294,65 @@ def todo_delete(todo_id):
     todo = db.session.query(Todo).filter(Todo.id == todo_id, Todo.user_id == session['user_id']).first()
     status = 200
     message = 'Todo has been deleted.'
-    if todo is None:
-        status = 404
-        message = 'That todo does not exist.'
-    else:
+    if todo is not None:
         db.session.delete(todo)
         db.session.commit()
-    flash(message, 'danger')
+    elif delete_archived_todo(session['user_id'], todo_id):
+        db.session.commit()
+    else:
+        status = 404
+        message = 'That todo does not exist.'
+    if not wants_fragment():
+        # shown by the page the script reloads, the todo list shows the message itself
+        flash(message, 'danger')
     return jsonify({'status': status, 'message': message}), status
 
 
+@app.route('/todo/jobs', methods=['POST'])
+@require_login
+def todos_job():
+    """
+    Completes every todo or deletes the completed ones in the background, the todo list polls the job until it is done
+    """
+    kind = request.form.get('kind')
+    if kind not in ('complete_all', 'delete_completed'):
+        abort(400)
+    session['job_id'] = queue_job(session['user_id'], kind)
+    flash('Your todos are being {}.'.format('completed' if kind == 'complete_all' else 'cleaned up'), 'success')
+    return redirect(url_for('todos'))
+
+
 @app.route('/todo/<int:todo_id>/json', methods=['GET'])
+@read_only
 def todo_json(todo_id):
-    status = 200
-    message = 'Success'
-    data = {}
     if not session.get('user_id'):
-        status = 401
-        message = 'Please login to access this page.'
-    else:
-        todo = db.session.query(Todo).filter(Todo.id == todo_id, Todo.user_id == session['user_id']).first()
+        return jsonify({'status': 401, 'message': 'Please login to access this page.', 'todo': {}}), 401
+
+    def render():
+        status = 200
+        message = 'Success'
+        data = {}
+        todo = find_todo(session['user_id'], todo_id)
         if todo is None:
             status = 404
             message = 'File not found.'
         else:
-            data = todo.as_dict()
-    return jsonify({'status': status, 'message': message, 'todo': data}), status
+            data = serialize_todos([todo])[0]
+        return jsonify({'status': status, 'message': message, 'todo': data}), status
+
+    return conditional(todos_etag(todos_version(), todo_id), render)
 
 
 @app.route('/show_completed', methods=['POST'])
 @require_login
 def show_completed():
     should_show = request.form.get('show_completed') is not None
-    flash('{} completed todos.'.format('Showing' if should_show else 'Hiding'), 'success')
-    resp = make_response(redirect(url_for('todos')))
-    showing = []
-    cookie = request.cookies.get('show_completed')
-    if cookie is not None:
-        showing = json.loads(cookie)
-    user_id = session.get('user_id')
-    if should_show and user_id not in showing:
-        showing.append(user_id)
-    elif not should_show and user_id in showing:
-        showing.remove(user_id)
-    resp.set_cookie('show_completed', json.dumps(showing))
-    return resp
+    message = '{} completed todos.'.format('Showing' if should_show else 'Hiding')
+    User.query.filter_by(id=session['user_id']).update({'show_completed': should_show})
+    db.session.commit()
+    if wants_fragment():
+        # the first page of the list, which is where the redirect would have taken the user
+        user = User.query.get_or_404(session['user_id'])
+        return render_todo_list('todo_list.html', user, 1, todos_per_page(request.form))
+    flash(message, 'success')
+    return redirect(url_for('todos'))
@@ -0,0 +1,99 @@
+import contextlib
+import os
+import shutil
+import tempfile
+from timeit import default_timer
+
+try:
+    from http.client import HTTPConnection
+    from urllib.parse import urlencode
+except ImportError:
+    from httplib import HTTPConnection
+    from urllib import urlencode
+
+from alayatodo import app, db
+from alayatodo.database import profile_config
+from alayatodo.models import User
+from alayatodo.seeding import bulk_seed
+
+
+@contextlib.contextmanager
+def temporary_database(profile=None):
+    """
+    Points the app to a fresh SQLite file for the duration of a benchmark, so we never touch the development database.
+    The database profile (see alayatodo.database) defaults to the configured one
+    """
+    directory = tempfile.mkdtemp(prefix='alayatodo-bench-')
+    previous = dict(app.config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///{}'.format(os.path.join(directory, 'bench.db'))
+    app.config.update(profile_config(profile or app.config['DATABASE_PROFILE'], app.config['SQLALCHEMY_DATABASE_URI']))
+    try:
+        with app.app_context():
+            db.create_all()
+            yield directory
+            db.session.remove()
+            db.get_engine().dispose()
+    finally:
+        app.config.update(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def insert_user_with_todos(username, todos, chunk_size=50000):
+    """
+    Inserts a user with `todos` todos using the bulk seeder, as ORM inserts are far too slow for millions of rows
+    """
+    rows = ({'description': 'Todo number {}'.format(i), 'completed': i % 2 == 0} for i in range(todos))
+    bulk_seed([{'username': username, 'todos': rows}], chunk_size, password=username)
+    return User.query.filter_by(username=username).one().id
+
+
+def logged_in_client(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+class HttpClient(object):
+    """
+    Minimal HTTP client keeping the session cookie, so the benchmark does not depend on anything outside the stdlib
+    """
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = HTTPConnection(self.host, self.port)
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';')[0]
+            return response.status
+        finally:
+            connection.close()
+
+
+def measure(function, repeat):
+    """
+    Calls `function` `repeat` times and returns the latencies in milliseconds
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = default_timer()
+        function()
+        latencies.append((default_timer() - start) * 1000)
+    return latencies
+
+
+def percentile(latencies, percent):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))]
@@ -0,0 +1,80 @@
+"""Concurrency benchmark
+
+Runs reader threads (GET /todo/) and writer threads (creating and completing todos) against the app through the Flask
+test client, and reports throughput and latency for each database profile. Run it from the project root with
+`python -m benchmarks.concurrency`.
+
+Usage:
+  concurrency.py [options]
+
+Options:
+  --readers=<n>   Reader threads [default: 8]
+  --writers=<n>   Writer threads [default: 2]
+  --seconds=<n>   Duration of each run [default: 10]
+  --todos=<n>     Todos seeded for the benchmarked user [default: 10000]
+  --profiles=<p>  Comma separated database profiles to compare [default: development,production]
+"""
+import itertools
+import threading
+from timeit import default_timer
+
+from docopt import docopt
+
+from alayatodo import app
+from benchmarks.common import temporary_database, insert_user_with_todos, logged_in_client, percentile
+
+
+def reader(client):
+    return client.get('/todo/')
+
+
+def writer(client, counter=itertools.count()):
+    number = next(counter)
+    if number % 2:
+        return client.post('/todo/{}'.format(number), data={'completed': 'on'})
+    return client.post('/todo/', data={'description': 'Concurrent todo {}'.format(number)})
+
+
+def worker(request, client, deadline, results):
+    while default_timer() < deadline:
+        start = default_timer()
+        try:
+            ok = request(client).status_code < 500
+        except Exception:
+            ok = False
+        results.append(((default_timer() - start) * 1000, ok))
+
+
+def run(profile, readers, writers, seconds, todos):
+    with temporary_database(profile):
+        user_id = insert_user_with_todos('bench', todos)
+        deadline = default_timer() + seconds
+        results = {'read': [], 'write': []}
+        threads = [threading.Thread(target=worker, args=(reader, logged_in_client(user_id), deadline, results['read']))
+                   for _ in range(readers)]
+        threads += [threading.Thread(target=worker, args=(writer, logged_in_client(user_id), deadline, results['write']))
+                    for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    for role in ('read', 'write'):
+        latencies = [latency for latency, ok in results[role]] or [0]
+        errors = len([ok for _, ok in results[role] if not ok])
+        print('{:<12} {:<6} {:>8.1f} req/s   p50 {:>8.2f} ms   p99 {:>8.2f} ms   errors {}'.format(
+            profile, role, len(results[role]) / float(seconds), percentile(latencies, 50),
+            percentile(latencies, 99), errors))
+
+
+def main(profiles, readers, writers, seconds, todos):
+    app.config['WTF_CSRF_ENABLED'] = False
+    # failed requests (e.g. "database is locked") are counted instead of being raised in the worker threads
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    for profile in profiles:
+        run(profile, readers, writers, seconds, todos)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['--profiles'].split(','), int(args['--readers']), int(args['--writers']), int(args['--seconds']),
+         int(args['--todos']))
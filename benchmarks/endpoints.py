@@ -0,0 +1,196 @@
+"""HTTP endpoints benchmark
+
+Seeds a dataset, drives a realistic mix of requests against the app and reports throughput, p50/p95/p99 latency and
+queries per request for every endpoint. Requests go through the Flask test client (inprocess mode) or through a local
+WSGI server over HTTP (server mode). Use --output to save the results as JSON and diff them between commits. Run it
+from the project root with `python -m benchmarks.endpoints`.
+
+Usage:
+  endpoints.py [options]
+
+Options:
+  --mode=<mode>          inprocess or server [default: inprocess]
+  --users=<n>            Users to seed [default: 20]
+  --todos-per-user=<n>   Todos to seed for every user [default: 1000]
+  --requests=<n>         Requests to send, logins included [default: 2000]
+  --concurrency=<n>      Concurrent clients [default: 4]
+  --profile=<profile>    Database profile [default: production]
+  --random-seed=<n>      Seed for the request mix, to replay the same run [default: 42]
+  --output=<path>        Write the results to this JSON file
+"""
+import collections
+import json
+import logging
+import random
+import re
+import threading
+from timeit import default_timer
+
+from docopt import docopt
+from flask import has_request_context, request
+from sqlalchemy import event
+from werkzeug.serving import make_server
+
+from alayatodo import app, db
+from alayatodo.models import User, Todo
+from alayatodo.seeding import fake_users, bulk_seed
+from benchmarks.common import temporary_database, percentile, HttpClient
+
+PASSWORD = 'benchmark'
+# endpoint -> weight, roughly what a user clicking around the list does
+MIX = [
+    ('todos', 45),
+    ('todo_json', 20),
+    ('todo_update', 15),
+    ('todos_post', 10),
+    ('todo_delete', 5),
+    ('login_post', 5),
+]
+
+
+class InProcessClient(object):
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class QueryCounter(object):
+    """
+    Counts the SQL statements executed while serving each endpoint
+    """
+
+    def __init__(self):
+        self.queries = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            with self.lock:
+                self.queries[request.endpoint] += 1
+
+
+class Worker(threading.Thread):
+    def __init__(self, client, users, requests, random_seed, results):
+        threading.Thread.__init__(self)
+        self.client = client
+        self.users = users
+        self.requests = requests
+        self.random = random.Random(random_seed)
+        self.results = results
+        self.todo_ids = []
+        self.endpoints = [endpoint for endpoint, weight in MIX for _ in range(weight)]
+
+    def run(self):
+        self.login()
+        for _ in range(self.requests - 1):
+            endpoint = self.random.choice(self.endpoints)
+            if endpoint == 'login_post':
+                self.login()
+            elif endpoint == 'todos':
+                self.call(endpoint, 'GET', '/todo/?page={}'.format(self.random.randint(1, 5)))
+            elif endpoint == 'todos_post':
+                self.call(endpoint, 'POST', '/todo/', {'description': 'Benchmark todo'})
+            elif not self.todo_ids:
+                self.call('todos', 'GET', '/todo/')
+            elif endpoint == 'todo_json':
+                self.call(endpoint, 'GET', '/todo/{}/json'.format(self.random.choice(self.todo_ids)))
+            elif endpoint == 'todo_update':
+                data = {'completed': 'on'} if self.random.random() < 0.5 else {}
+                self.call(endpoint, 'POST', '/todo/{}'.format(self.random.choice(self.todo_ids)), data)
+            elif endpoint == 'todo_delete':
+                todo_id = self.todo_ids.pop(self.random.randrange(len(self.todo_ids)))
+                self.call(endpoint, 'DELETE', '/todo/{}'.format(todo_id))
+
+    def login(self):
+        username, self.todo_ids = self.random.choice(self.users)
+        self.todo_ids = list(self.todo_ids)
+        self.call('login_post', 'POST', '/login', {'username': username, 'password': PASSWORD})
+
+    def call(self, endpoint, method, path, data=None):
+        start = default_timer()
+        try:
+            ok = self.client.request(method, path, data) < 500
+        except Exception:
+            ok = False
+        self.results.append((endpoint, (default_timer() - start) * 1000, ok))
+
+
+def seed(users, todos_per_user):
+    bulk_seed(fake_users(users, todos_per_user, PASSWORD), password=PASSWORD)
+    todo_ids = collections.defaultdict(list)
+    for todo_id, user_id in db.session.query(Todo.id, Todo.user_id):
+        todo_ids[user_id].append(todo_id)
+    return [(username, todo_ids[user_id]) for user_id, username in db.session.query(User.id, User.username)]
+
+
+def run(mode, users, requests, concurrency, random_seed):
+    results = []
+    server = None
+    if mode == 'server':
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever).start()
+        clients = [HttpClient('127.0.0.1', server.server_port) for _ in range(concurrency)]
+    else:
+        clients = [InProcessClient() for _ in range(concurrency)]
+    workers = [Worker(client, users, requests // concurrency, random_seed + number, results)
+               for number, client in enumerate(clients)]
+    start = default_timer()
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results, default_timer() - start
+
+
+def summarize(results, elapsed, queries):
+    endpoints = {}
+    for endpoint in sorted(set(endpoint for endpoint, _, _ in results)):
+        latencies = [latency for name, latency, _ in results if name == endpoint]
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'errors': len([ok for name, _, ok in results if name == endpoint and not ok]),
+            'throughput': len(latencies) / elapsed,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'queries_per_request': queries[endpoint] / float(len(latencies)),
+        }
+    latencies = [latency for _, latency, _ in results]
+    total = {'requests': len(results), 'throughput': len(results) / elapsed, 'p50': percentile(latencies, 50),
+             'p95': percentile(latencies, 95), 'p99': percentile(latencies, 99)}
+    return {'endpoints': endpoints, 'total': total}
+
+
+def main(args):
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    queries = QueryCounter()
+    with temporary_database(args['--profile']):
+        users = seed(int(args['--users']), int(args['--todos-per-user']))
+        event.listen(db.engine, 'before_cursor_execute', queries)
+        results, elapsed = run(args['--mode'], users, int(args['--requests']), int(args['--concurrency']),
+                               int(args['--random-seed']))
+        event.remove(db.engine, 'before_cursor_execute', queries)
+    summary = summarize(results, elapsed, queries.queries)
+    summary['settings'] = {re.sub('^--', '', key): value for key, value in args.items() if key != '--output'}
+    print('{:<12} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+    for endpoint, stats in sorted(summary['endpoints'].items()):
+        print('{:<12} {requests:>8} {errors:>7} {throughput:>9.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f} '
+              '{queries_per_request:>8.2f}'.format(endpoint, **stats))
+    print('{:<12} {requests:>8} {:>7} {throughput:>9.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f}'.format(
+        'total', '', **summary['total']))
+    if args['--output']:
+        with open(args['--output'], 'w') as output:
+            json.dump(summary, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(docopt(__doc__))
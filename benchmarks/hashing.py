@@ -0,0 +1,52 @@
+"""Password hashing benchmark
+
+Reports how many logins per second one core can verify with each candidate PASSWORD_HASH_METHOD, to pick the cost of
+the password hashes for the hardware the app runs on. Every process verifies hashes in a loop, so with --processes set
+to the number of cores the per core figure includes the contention between them. Run it from the project root with
+`python -m benchmarks.hashing`.
+
+Usage:
+  hashing.py [options]
+
+Options:
+  --methods=<methods>  Comma separated werkzeug hash methods
+                       [default: pbkdf2:sha256:50000,pbkdf2:sha256:150000,pbkdf2:sha256:260000,pbkdf2:sha512:150000]
+  --processes=<n>      Processes verifying hashes at the same time, defaults to the number of cores
+  --seconds=<n>        Duration of each measurement [default: 3]
+"""
+import multiprocessing
+from timeit import default_timer
+
+from docopt import docopt
+from werkzeug.security import generate_password_hash, check_password_hash
+
+PASSWORD = 'benchmark'
+
+
+def verifications(args):
+    password_hash, seconds = args
+    count = 0
+    deadline = default_timer() + seconds
+    while default_timer() < deadline:
+        check_password_hash(password_hash, PASSWORD)
+        count += 1
+    return count
+
+
+def main(methods, processes, seconds):
+    pool = multiprocessing.Pool(processes)
+    print('{} processes'.format(processes))
+    print('{:<24} {:>21} {:>16}'.format('method', 'verifications/s/core', 'ms/verification'))
+    try:
+        for method in methods:
+            password_hash = generate_password_hash(PASSWORD, method)
+            per_core = sum(pool.map(verifications, [(password_hash, seconds)] * processes)) / float(processes * seconds)
+            print('{:<24} {:>21.1f} {:>16.2f}'.format(method, per_core, 1000 / per_core))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['--methods'].split(','), int(args['--processes'] or multiprocessing.cpu_count()), int(args['--seconds']))
@@ -0,0 +1,87 @@
+"""Login load benchmark
+
+Measures /todo/ latency for a logged in user while other clients hammer /login with wrong passwords, the way a
+credential stuffing attack would. Compares no attack, the attack with passwords checked on the request threads and no
+throttling (before), and the attack with the hashing pool and the login throttle (after). Run it from the project root
+with `python -m benchmarks.login`.
+
+Usage:
+  login.py [options]
+
+Options:
+  --attackers=<n>   Threads posting to /login [default: 16]
+  --addresses=<n>   IP addresses the attackers are spread over [default: 4]
+  --readers=<n>     Threads reading /todo/ [default: 2]
+  --seconds=<n>     Duration of each scenario [default: 10]
+"""
+import collections
+import itertools
+import threading
+from timeit import default_timer
+
+from docopt import docopt
+
+from alayatodo import app, db, views
+from alayatodo.models import User
+from alayatodo.security import PasswordVerifier, LoginThrottle
+from alayatodo.seeding import fake_users, bulk_seed
+from benchmarks.common import temporary_database, logged_in_client, percentile
+
+
+def reader(client, deadline, latencies):
+    while default_timer() < deadline:
+        start = default_timer()
+        client.get('/todo/')
+        latencies.append((default_timer() - start) * 1000)
+
+
+def attacker(address, usernames, deadline, statuses):
+    client = app.test_client()
+    for username in itertools.cycle(usernames):
+        if default_timer() >= deadline:
+            break
+        response = client.post('/login', data={'username': username, 'password': 'wrong'},
+                               environ_base={'REMOTE_ADDR': address})
+        statuses[response.status_code] += 1
+
+
+def scenario(name, user_id, usernames, attackers, addresses, readers, seconds):
+    deadline = default_timer() + seconds
+    latencies, statuses = [], collections.Counter()
+    threads = [threading.Thread(target=reader, args=(logged_in_client(user_id), deadline, latencies))
+               for _ in range(readers)]
+    threads += [threading.Thread(target=attacker, args=('10.0.0.{}'.format(number % addresses), usernames,
+                                                        deadline, statuses))
+                for number in range(attackers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('{:<8} /todo/ {:>7.1f} req/s   p50 {:>8.2f} ms   p99 {:>8.2f} ms   /login {:>7.1f} req/s {}'.format(
+        name, len(latencies) / float(seconds), percentile(latencies, 50), percentile(latencies, 99),
+        sum(statuses.values()) / float(seconds), dict(statuses)))
+
+
+def main(attackers, addresses, readers, seconds):
+    app.config['WTF_CSRF_ENABLED'] = False
+    with temporary_database():
+        bulk_seed(fake_users(50, 100, 'benchmark'), password='benchmark')
+        users = db.session.query(User.id, User.username).all()
+        user_id, usernames = users[0][0], [username for _, username in users]
+        verifier, throttle = views.password_verifier, views.login_throttle
+        try:
+            scenario('idle', user_id, usernames, 0, addresses, readers, seconds)
+            # before: every request thread hashes the password itself and nothing is throttled
+            views.password_verifier = PasswordVerifier(0, 0, 0)
+            views.login_throttle = LoginThrottle(None, None, 0)
+            scenario('before', user_id, usernames, attackers, addresses, readers, seconds)
+            views.password_verifier, views.login_throttle = verifier, throttle
+            throttle.reset()
+            scenario('after', user_id, usernames, attackers, addresses, readers, seconds)
+        finally:
+            views.password_verifier, views.login_throttle = verifier, throttle
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--attackers']), int(args['--addresses']), int(args['--readers']), int(args['--seconds']))
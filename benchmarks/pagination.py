@@ -0,0 +1,64 @@
+"""Pagination benchmark
+
+Compares the latency of the first and a deep page of /todo/ for a user with a large number of todos, before (page
+numbers, no index) and after (cursor pagination over the (user_id, completed, id) index). Run it from the project root
+with `python -m benchmarks.pagination`.
+
+Usage:
+  pagination.py [options]
+
+Options:
+  --todos=<n>     Todos owned by the benchmarked user [default: 1000000]
+  --page=<n>      Deep page to compare against the first one [default: 1000]
+  --per-page=<n>  Todos per page [default: 10]
+  --repeat=<n>    Requests per measurement [default: 20]
+"""
+from docopt import docopt
+
+from alayatodo import db
+from alayatodo.models import Todo
+from alayatodo.pagination import encode_cursor
+from benchmarks.common import temporary_database, insert_user_with_todos, logged_in_client, measure, percentile
+
+INDEX = next(i for i in Todo.__table__.indexes if i.name == 'ix_todo_user_id_completed_id')
+
+
+def cursor_for_page(user_id, page, per_page):
+    if page == 1:
+        return ''
+    last = db.session.query(Todo).filter(Todo.user_id == user_id, Todo.completed == False) \
+        .order_by(Todo.id.desc()).offset((page - 1) * per_page - 1).first()
+    return encode_cursor(last)
+
+
+def report(name, client, query_strings, repeat):
+    for label, query_string in query_strings:
+        url = '/todo/?{}'.format(query_string)
+        assert client.get(url).status_code == 200
+        latencies = measure(lambda: client.get(url), repeat)
+        print('{:<22} {:<10} p50 {:>9.2f} ms   p99 {:>9.2f} ms'.format(
+            name, label, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+def main(todos, page, per_page, repeat):
+    with temporary_database():
+        print('Seeding {} todos...'.format(todos))
+        user_id = insert_user_with_todos('bench', todos)
+        client = logged_in_client(user_id)
+        offset_pages = [('page 1', 'page=1&per_page={}'.format(per_page)),
+                        ('page {}'.format(page), 'page={}&per_page={}'.format(page, per_page))]
+
+        INDEX.drop(db.engine)
+        report('before (offset)', client, offset_pages, repeat)
+
+        INDEX.create(db.engine)
+        report('offset + index', client, offset_pages, repeat)
+        cursor_pages = [('page 1', 'after=&per_page={}'.format(per_page)),
+                        ('page {}'.format(page), 'after={}&per_page={}'.format(
+                            cursor_for_page(user_id, page, per_page), per_page))]
+        report('after (cursor)', client, cursor_pages, repeat)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--todos']), int(args['--page']), int(args['--per-page']), int(args['--repeat']))
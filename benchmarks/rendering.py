@@ -0,0 +1,67 @@
+"""Rendering benchmark
+
+Measures the render time and size of the todo list template for pages of 10, 100 and 1000 rows, past the
+TODOS_PER_PAGE_LIMIT the view enforces, and how long a new worker takes to load the templates with and without the
+bytecode cache (see TEMPLATE_CACHE_DIR). Run it from the project root with `python -m benchmarks.rendering`.
+
+Usage:
+  rendering.py [options]
+
+Options:
+  --rows=<list>  Comma separated rows per rendered page [default: 10,100,1000]
+  --repeat=<n>   Renders per measurement [default: 50]
+"""
+import shutil
+import tempfile
+
+from docopt import docopt
+from flask import render_template, session
+from jinja2 import FileSystemBytecodeCache
+
+from alayatodo import app, db
+from alayatodo.models import Todo
+from alayatodo.pagination import paginate_counted
+from benchmarks.common import temporary_database, insert_user_with_todos, measure, percentile
+
+TEMPLATES = ('todos.html', 'todo_list.html', 'layout.html', 'macros.html')
+
+
+def render_page(user_id, rows):
+    query = db.session.query(Todo).filter(Todo.user_id == user_id).order_by(Todo.completed.asc(), Todo.id.desc())
+    todos = paginate_counted(query, 1, rows, rows)
+    return lambda: render_template('todos.html', todos=todos, per_page=rows, show_completed=True, keyset=False)
+
+
+def load_templates(bytecode_cache):
+    # a fresh environment per load, as a new worker process would have
+    environment = app.create_jinja_environment()
+    environment.bytecode_cache = bytecode_cache
+    for template in TEMPLATES:
+        environment.get_template(template)
+
+
+def main(rows, repeat):
+    with temporary_database():
+        user_id = insert_user_with_todos('bench', max(rows))
+        with app.test_request_context('/todo/'):
+            session['user_id'], session['username'] = user_id, 'bench'
+            for count in rows:
+                render = render_page(user_id, count)
+                size = len(render().encode('utf-8'))
+                latencies = measure(render, repeat)
+                print('{:>5} rows   p50 {:>8.2f} ms   p99 {:>8.2f} ms   {:>9,} bytes   {:>6,} bytes/row'.format(
+                    count, percentile(latencies, 50), percentile(latencies, 99), size, size // count))
+    directory = tempfile.mkdtemp(prefix='alayatodo-bench-templates-')
+    try:
+        cache = FileSystemBytecodeCache(directory)
+        load_templates(cache)
+        for name, bytecode_cache in (('compiling templates', None), ('bytecode cache', cache)):
+            latencies = measure(lambda: load_templates(bytecode_cache), repeat)
+            print('Cold template load, {:<20} p50 {:>8.2f} ms'.format(name, percentile(latencies, 50)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main([int(rows) for rows in args['--rows'].split(',')], int(args['--repeat']))
@@ -0,0 +1,64 @@
+"""Search benchmark
+
+Compares /api/todos/search over the FTS5 index with the naive LIKE '%term%' scan it falls back to without the index, for
+a user with a large number of todos among other users, searching a frequent word, a rare word and two words. Run it
+from the project root with `python -m benchmarks.search`.
+
+Usage:
+  search.py [options]
+
+Options:
+  --todos=<n>        Todos owned by the benchmarked user [default: 200000]
+  --other-users=<n>  Other users, with as many todos between them [default: 100]
+  --repeat=<n>       Requests per measurement [default: 20]
+"""
+import collections
+
+from docopt import docopt
+
+from alayatodo import app, db, search
+from alayatodo.models import Todo, User
+from alayatodo.seeding import fake_users, bulk_seed
+from benchmarks.common import temporary_database, logged_in_client, measure, percentile
+
+
+def search_terms(user_id):
+    """
+    A frequent word, a rare word and the two most frequent words, taken from a sample of the user's todos
+    """
+    words = collections.Counter()
+    for description, in db.session.query(Todo.description).filter(Todo.user_id == user_id).limit(10000):
+        words.update(word.strip('.').lower() for word in description.split())
+    ranked = [word for word, _ in words.most_common() if len(word) > 3]
+    return [('frequent', ranked[0]), ('rare', ranked[-1]), ('two words', '{} {}'.format(ranked[0], ranked[1]))]
+
+
+def report(name, client, terms, repeat):
+    for label, q in terms:
+        url = '/api/todos/search?q={}'.format(q)
+        assert client.get(url).status_code == 200
+        latencies = measure(lambda: client.get(url), repeat)
+        print('{:<14} {:<10} p50 {:>9.2f} ms   p99 {:>9.2f} ms'.format(
+            name, label, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+def main(todos, other_users, repeat):
+    with temporary_database():
+        print('Seeding {} todos, and as many for {} other users...'.format(todos, other_users))
+        bulk_seed(fake_users(1, todos, 'benchmark'), password='benchmark')
+        bulk_seed(fake_users(other_users, max(todos // max(other_users, 1), 1), 'benchmark'), password='benchmark')
+        user_id = db.session.query(db.func.min(User.id)).scalar()
+        client = logged_in_client(user_id)
+        terms = search_terms(user_id)
+
+        report('after (FTS5)', client, terms, repeat)
+        search._fts_enabled[app.config['SQLALCHEMY_DATABASE_URI']] = False
+        try:
+            report('before (LIKE)', client, terms, repeat)
+        finally:
+            search._fts_enabled.clear()
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--todos']), int(args['--other-users']), int(args['--repeat']))
@@ -0,0 +1,60 @@
+"""Serialization benchmark
+
+Compares how many todos per second each serialization path dumps: the original Todo.as_dict (a new TodoSchema per
+call), a single TodoSchema instance, and serialize_todos over Todo instances or plain row tuples. Run it from the
+project root with `python -m benchmarks.serialization`.
+
+Usage:
+  serialization.py [options]
+
+Options:
+  --todos=<n>   Todos to serialize [default: 20000]
+  --repeat=<n>  Runs per measurement, the best one is reported [default: 3]
+"""
+from docopt import docopt
+
+from alayatodo import db
+from alayatodo.models import Todo, TodoSchema, TODO_COLUMNS, serialize_todos
+from benchmarks.common import temporary_database, insert_user_with_todos, measure
+
+
+def schema_per_call(todos):
+    return [TodoSchema().dump(todo).data for todo in todos]
+
+
+def shared_schema(todos, schema=TodoSchema()):
+    return [schema.dump(todo).data for todo in todos]
+
+
+def load_todos(user_id):
+    return db.session.query(Todo).filter(Todo.user_id == user_id).all()
+
+
+def load_rows(user_id):
+    return db.session.query(*TODO_COLUMNS).filter(Todo.user_id == user_id).all()
+
+
+def report(name, todos, function, repeat):
+    best = min(measure(function, repeat))
+    print('{:<40} {:>12,.0f} todos/s'.format(name, todos / (best / 1000)))
+
+
+def main(todos, repeat):
+    with temporary_database():
+        user_id = insert_user_with_todos('bench', todos)
+        instances = load_todos(user_id)
+        rows = load_rows(user_id)
+        print('Serialization only, {} todos already loaded'.format(todos))
+        report('as_dict before (TodoSchema per call)', todos, lambda: schema_per_call(instances), repeat)
+        report('shared TodoSchema instance', todos, lambda: shared_schema(instances), repeat)
+        report('serialize_todos(Todo instances)', todos, lambda: serialize_todos(instances), repeat)
+        report('serialize_todos(row tuples)', todos, lambda: serialize_todos(rows), repeat)
+        print('Query and serialization')
+        report('query Todo + as_dict before', todos, lambda: schema_per_call(load_todos(user_id)), repeat)
+        report('query Todo + serialize_todos', todos, lambda: serialize_todos(load_todos(user_id)), repeat)
+        report('query TODO_COLUMNS + serialize_todos', todos, lambda: serialize_todos(load_rows(user_id)), repeat)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--todos']), int(args['--repeat']))
@@ -0,0 +1,122 @@
+"""Serving modes benchmark
+
+Starts `main.py serve` in sync (a pool of threads) and async (gevent, a greenlet per connection) mode on a seeded
+database with the production profile, and reports throughput and latency percentiles of the todo list and JSON views
+for each number of concurrent connections. Async mode needs gevent. Run it from the project root with
+`python -m benchmarks.serving`.
+
+Usage:
+  serving.py [options]
+
+Options:
+  --users=<n>            Users to seed [default: 20]
+  --todos-per-user=<n>   Todos to seed for every user [default: 1000]
+  --concurrency=<list>   Comma separated numbers of concurrent connections [default: 10,100]
+  --seconds=<n>          Duration of each measurement [default: 10]
+  --modes=<list>         Comma separated serving modes [default: sync,async]
+  --workers=<n>          Worker processes of the server [default: 1]
+  --threads=<n>          Threads of every worker in sync mode [default: 4]
+"""
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from timeit import default_timer
+
+from docopt import docopt
+
+from alayatodo import app, db
+from alayatodo.models import User, Todo
+from alayatodo.seeding import fake_users, bulk_seed
+from alayatodo.sessions import ServerSideSessionInterface, SqliteStore, new_session_id
+from benchmarks.common import temporary_database, percentile, HttpClient
+
+PORT = 5099
+
+
+def sessions(directory):
+    """
+    Logs every user in straight through the shared session store, as the server runs with CSRF protection
+    """
+    store = SqliteStore(os.path.join(directory, 'sessions.db'))
+    users = []
+    for user_id, username in db.session.query(User.id, User.username):
+        sid = new_session_id()
+        data = ServerSideSessionInterface.serializer.dumps({'user_id': user_id, 'username': username})
+        store.save(sid, data, time.time() + 3600)
+        todo_ids = [todo_id for todo_id, in db.session.query(Todo.id).filter(Todo.user_id == user_id).limit(100)]
+        users.append((sid, todo_ids))
+    return users
+
+
+def start_server(mode, directory, workers, threads):
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'], DATABASE_PROFILE='production',
+               SESSION_STORE='sqlite', SESSION_SQLITE_PATH=os.path.join(directory, 'sessions.db'))
+    command = [sys.executable, 'main.py', 'serve', '--port={}'.format(PORT), '--workers={}'.format(workers),
+               '--threads={}'.format(threads)] + (['--async'] if mode == 'async' else [])
+    with open(os.devnull, 'w') as devnull:
+        server = subprocess.Popen(command, env=env, stderr=devnull)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', PORT)).close()
+            return server
+        except socket.error:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('The {} server did not start'.format(mode))
+
+
+def client(users, deadline, seed, results):
+    rng = random.Random(seed)
+    http = HttpClient('127.0.0.1', PORT)
+    while default_timer() < deadline:
+        sid, todo_ids = rng.choice(users)
+        http.cookie = 'session={}'.format(sid)
+        if rng.random() < 0.5:
+            path = '/todo/?page={}'.format(rng.randint(1, 5))
+        else:
+            path = '/todo/{}/json'.format(rng.choice(todo_ids))
+        start = default_timer()
+        try:
+            ok = http.request('GET', path) == 200
+        except Exception:
+            ok = False
+        results.append(((default_timer() - start) * 1000, ok))
+
+
+def measure(users, concurrency, seconds):
+    results = []
+    deadline = default_timer() + seconds
+    threads = [threading.Thread(target=client, args=(users, deadline, number, results)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = [latency for latency, _ in results]
+    errors = len([ok for _, ok in results if not ok])
+    return len(results) / float(seconds), errors, percentile(latencies, 50), percentile(latencies, 99)
+
+
+def main(users, todos_per_user, concurrency, seconds, modes, workers, threads):
+    print('{:<6} {:>11} {:>9} {:>7} {:>9} {:>9}'.format('mode', 'connections', 'req/s', 'errors', 'p50 ms', 'p99 ms'))
+    with temporary_database('production') as directory:
+        bulk_seed(fake_users(users, todos_per_user, 'benchmark'), password='benchmark')
+        logged_in = sessions(directory)
+        for mode in modes:
+            server = start_server(mode, directory, workers, threads)
+            try:
+                for connections in concurrency:
+                    print('{:<6} {:>11} {:>9.1f} {:>7} {:>9.2f} {:>9.2f}'.format(
+                        mode, connections, *measure(logged_in, connections, seconds)))
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--users']), int(args['--todos-per-user']), [int(n) for n in args['--concurrency'].split(',')],
+         int(args['--seconds']), args['--modes'].split(','), int(args['--workers']), int(args['--threads']))
@@ -3,14 +3,46 @@
 Usage:
   main.py [run]
   main.py initdb
+  main.py recount
+  main.py archive [--older-than=<days>] [--chunk-size=<n>]
+  main.py seed [--users=<n>] [--todos-per-user=<n>] [--chunk-size=<n>] [--password=<password>]
+  main.py serve [--host=<host>] [--port=<port>] [--workers=<n>] [--threads=<n>] [--async] [--connections=<n>]
+
+Options:
+  --users=<n>            Users to generate [default: 100]
+  --todos-per-user=<n>   Todos to generate for every user [default: 100]
+  --chunk-size=<n>       Rows written per batch and transaction [default: 10000]
+  --older-than=<days>    Archive the todos completed more than this many days ago, ARCHIVE_AFTER_DAYS if not given
+  --password=<password>  Password for every generated user, hashed only once. Each user gets a random password
+                         (hashed separately, which is much slower) if not given
+  --host=<host>          Address to listen on [default: 127.0.0.1]
+  --port=<port>          Port to listen on [default: 5000]
+  --workers=<n>          Worker processes forked once the app is loaded [default: 2]
+  --threads=<n>          Threads serving requests in every worker [default: 4]
+  --async                Serve with gevent, a greenlet instead of a thread per connection (needs gevent)
+  --connections=<n>      Concurrent connections served by every worker in async mode [default: 1000]
 """
+import sys
+
+if __name__ == '__main__' and 'serve' in sys.argv and '--async' in sys.argv:
+    # gevent has to patch the standard library before anything imports socket, threading or a database driver
+    from gevent import monkey
+
+    monkey.patch_all()
+
+import datetime
 import json
+from timeit import default_timer
 
 from docopt import docopt
 from flask_migrate import upgrade
 from sqlalchemy.exc import IntegrityError
 
 from alayatodo import app, db, models
+from alayatodo.archive import archive_todos
+from alayatodo.feed import prune_changes
+from alayatodo.seeding import fake_users, bulk_seed
+from alayatodo.serving import serve
 
 
 def seed(path):
@@ -34,6 +66,12 @@ def seed(path):
         print('Seeds file not found, make sure {} exists.'.format(path))
 
 
+def seed_fake(users, todos_per_user, chunk_size, password):
+    start = default_timer()
+    users, todos = bulk_seed(fake_users(users, todos_per_user, password), chunk_size, password)
+    print('Inserted {} users and {} todos in {:.1f}s.'.format(users, todos, default_timer() - start))
+
+
 if __name__ == '__main__':
     args = docopt(__doc__)
     seeds_file_path = 'resources/seeds.json'
@@ -45,5 +83,30 @@ if __name__ == '__main__':
             print('Seeding database with initial values. You can find initial values in {}'.format(seeds_file_path))
             seed(seeds_file_path)
             print('All done, database initialized.')
+    elif args['seed']:
+        with app.app_context():
+            print('Seeding database with generated users and todos.')
+            seed_fake(int(args['--users']), int(args['--todos-per-user']), int(args['--chunk-size']),
+                      args['--password'])
+    elif args['recount']:
+        with app.app_context():
+            print('Rebuilding todo counters for every user.')
+            models.User.recount_todos()
+            db.session.commit()
+            print('All done, todo counters rebuilt.')
+    elif args['archive']:
+        with app.app_context():
+            days = int(args['--older-than'] or app.config['ARCHIVE_AFTER_DAYS'])
+            print('Archiving the todos completed more than {} days ago.'.format(days))
+            start = default_timer()
+            moved = archive_todos(datetime.timedelta(days=days), int(args['--chunk-size']))
+            print('Archived {} todos in {:.1f}s.'.format(moved, default_timer() - start))
+            days = app.config['FEED_RETENTION_DAYS']
+            print('Pruning the todo changes logged more than {} days ago.'.format(days))
+            pruned = prune_changes(datetime.timedelta(days=days), int(args['--chunk-size']))
+            print('Pruned {} changes.'.format(pruned))
+    elif args['serve']:
+        serve(app, args['--host'], int(args['--port']), int(args['--workers']), int(args['--threads']),
+              int(args['--connections']) if args['--async'] else None)
     else:
         app.run(use_reloader=True)
@@ -0,0 +1,70 @@
+"""strictly increasing todo ids
+
+Revision ID: a81f3c6e5d94
+Revises: 4e2d8b6a0c37
+Create Date: 2026-10-19 10:48:05.137512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a81f3c6e5d94'
+down_revision = '4e2d8b6a0c37'
+branch_labels = None
+depends_on = None
+
+FTS_TRIGGERS = [
+    "CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+    "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END",
+    "CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+    "VALUES ('delete', old.id, old.user_id, old.description); END",
+    "CREATE TRIGGER todo_fts_update AFTER UPDATE OF user_id, description ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+    "VALUES ('delete', old.id, old.user_id, old.description); "
+    "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END",
+]
+
+
+def upgrade():
+    # Without AUTOINCREMENT SQLite hands out max(id) + 1, the id of a deleted or archived todo when it was the newest,
+    # which tombstones, the change log and the archive still refer to. Other databases never reuse sequence values
+    bind = op.get_bind()
+    if bind.dialect.name != 'sqlite':
+        return
+    has_fts = bind.execute("SELECT count(*) FROM sqlite_master WHERE name = 'todo_fts'").scalar()
+    # rebuilt by hand rather than with batch_alter_table, which would lose the DESC of the list index
+    op.create_table('_todo_autoincrement',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('description', sa.String(length=255), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=True),
+                    sa.Column('completed', sa.Boolean(create_constraint=False), server_default='0', nullable=False),
+                    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+                    sa.Column('completed_at', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+                    sa.PrimaryKeyConstraint('id'),
+                    sqlite_autoincrement=True
+                    )
+    op.execute('INSERT INTO _todo_autoincrement (id, description, user_id, completed, version, completed_at) '
+               'SELECT id, description, user_id, completed, version, completed_at FROM todo')
+    op.drop_table('todo')
+    op.rename_table('_todo_autoincrement', 'todo')
+    op.create_index('ix_todo_user_id_completed_id', 'todo', ['user_id', 'completed', sa.text('id DESC')], unique=False)
+    op.create_index('ix_todo_user_id_version', 'todo', ['user_id', 'version'], unique=False)
+    op.create_index('ix_todo_completed_at', 'todo', ['completed_at'], unique=False)
+    # the ids handed out so far, including the ones no longer in the table
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'todo'")
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'todo', max(id) FROM ("
+               "SELECT max(id) AS id FROM todo UNION ALL SELECT max(id) FROM todo_archive "
+               "UNION ALL SELECT max(todo_id) FROM todo_tombstone UNION ALL SELECT max(todo_id) FROM todo_change) "
+               "HAVING max(id) IS NOT NULL")
+    if has_fts:
+        # dropped along with the old table, the index itself still matches the rows
+        for trigger in FTS_TRIGGERS:
+            op.execute(trigger)
+
+
+def downgrade():
+    # AUTOINCREMENT is harmless to the earlier revisions, the table is left as it is
+    pass
@@ -7,8 +7,7 @@ Create Date: 2019-07-11 20:13:56.940587
 """
 from alembic import op
 import sqlalchemy as sa
-from alayatodo.models import User
-from alayatodo import db
+from werkzeug.security import generate_password_hash
 
 # revision identifiers, used by Alembic.
 revision = 'bf12b0a21146'
@@ -21,11 +20,13 @@ def upgrade():
     # ### commands auto generated by Alembic - please adjust! ###
     with op.batch_alter_table('user') as bop:
         bop.alter_column('password', new_column_name='password_hash')
-    users = User.query.all()
-    for user in users:
-        user.set_password(user.password_hash)
-        db.session.add(user)
-    db.session.commit()
+    # hash through the migration connection, databases with transactional DDL (e.g. PostgreSQL) would not show the
+    # renamed column to another connection, and the User model may have grown columns that do not exist yet
+    connection = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('password_hash', sa.String))
+    for user_id, password in connection.execute(sa.select([user.c.id, user.c.password_hash])).fetchall():
+        connection.execute(user.update().where(user.c.id == user_id).values(
+            password_hash=generate_password_hash(password)))
     # ### end Alembic commands ###
 
 
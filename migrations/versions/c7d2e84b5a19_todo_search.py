@@ -0,0 +1,46 @@
+"""todo full text search index
+
+Revision ID: c7d2e84b5a19
+Revises: a4c93e6f1d27
+Create Date: 2026-10-18 17:42:10.301657
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e84b5a19'
+down_revision = 'a4c93e6f1d27'
+branch_labels = None
+depends_on = None
+
+
+def has_fts5(bind):
+    return bind.dialect.name == 'sqlite' and bind.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()
+
+
+def upgrade():
+    # SQLite only, other databases search with LIKE (see alayatodo.search)
+    bind = op.get_bind()
+    if not has_fts5(bind):
+        return
+    op.execute("CREATE VIRTUAL TABLE todo_fts USING fts5(user_id, description, content='todo', content_rowid='id')")
+    op.execute("CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+               "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END")
+    op.execute("CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+               "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+               "VALUES ('delete', old.id, old.user_id, old.description); END")
+    op.execute("CREATE TRIGGER todo_fts_update AFTER UPDATE OF user_id, description ON todo BEGIN "
+               "INSERT INTO todo_fts (todo_fts, rowid, user_id, description) "
+               "VALUES ('delete', old.id, old.user_id, old.description); "
+               "INSERT INTO todo_fts (rowid, user_id, description) VALUES (new.id, new.user_id, new.description); END")
+    op.execute("INSERT INTO todo_fts (todo_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER IF EXISTS todo_fts_insert')
+    op.execute('DROP TRIGGER IF EXISTS todo_fts_delete')
+    op.execute('DROP TRIGGER IF EXISTS todo_fts_update')
+    op.execute('DROP TABLE IF EXISTS todo_fts')
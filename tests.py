@@ -1,11 +1,34 @@
+import csv
+import datetime
 import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from urlparse import parse_qs, urlsplit
 
 from faker import Faker
+from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
 
-from alayatodo import app, db
-from alayatodo.models import User, Todo
+from alayatodo import app, db, jobs, views, template_bytecode_cache
+from alayatodo.archive import archive_todos
+from alayatodo.database import profile_config, REPLICA_BIND
+from alayatodo.feed import ChangeFeed, prune_changes
+from alayatodo.instrumentation import QueryBudgetExceeded
+from alayatodo.jobs import JobQueue
+from alayatodo.models import ArchivedTodo, Job, User, Todo, TodoChange, TodoSchema, TODO_COLUMNS, serialize_todos
+from alayatodo.pagination import encode_cursor, decode_cursor
+from alayatodo.security import LoginUnavailable, PasswordVerifier, needs_rehash
+from alayatodo.seeding import fake_users, bulk_seed
+from alayatodo.sessions import ServerSideSessionInterface, MemoryStore, SqliteStore, private_sessions_path
 
 myFactory = Faker()
 
@@ -41,6 +64,10 @@ def get_todos(client):
     return client.get('/todo/', follow_redirects=True)
 
 
+def get_todos_page(client, **params):
+    return client.get('/todo/', query_string=params, follow_redirects=True)
+
+
 def get_todo(client, todo_id):
     return client.get('/todo/{}'.format(todo_id), follow_redirects=True)
 
@@ -57,10 +84,56 @@ def json_todo(client, todo_id):
     return client.get('/todo/{}/json'.format(todo_id), follow_redirects=True)
 
 
+def api_todos(client, **params):
+    return client.get('/api/todos', query_string=params)
+
+
+def api_batch(client, batch):
+    return client.post('/api/todos', data=json.dumps(batch), content_type='application/json')
+
+
+def queue_job(client, kind, **body):
+    return client.post('/api/todos/jobs', data=json.dumps(dict(body, kind=kind)), content_type='application/json')
+
+
+def get_job(client, job_id):
+    return client.get('/api/todos/jobs/{}'.format(job_id))
+
+
+def todo_events(client, **headers):
+    response = client.get('/api/todos/events', headers=headers)
+    events = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'data' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def sync_todos(client, **params):
+    return client.get('/api/todos/changes', query_string=params)
+
+
+def search_todos(client, q, **params):
+    return client.get('/api/todos/search', query_string=dict(params, q=q))
+
+
+def export_todos(client, export_format):
+    return client.get('/api/todos/export.{}'.format(export_format))
+
+
 def visit_login(client):
     return client.get('/login', follow_redirects=True)
 
 
+def session_id(client):
+    return next(cookie.value for cookie in client.cookie_jar if cookie.name == app.session_cookie_name)
+
+
+def post_fragment(client, url, **data):
+    return client.post(url, data=data, headers={'X-Fragment': '1'})
+
+
 def show_completed(client, show):
     return client.post('/show_completed', data=dict(show_completed=show), follow_redirects=True)
 
@@ -70,8 +143,15 @@ class AlayatodoTests(unittest.TestCase):
         """
         Creates a new database for the unit test to use
         """
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('TEST_DATABASE_URI', 'sqlite://')
         app.config['WTF_CSRF_METHODS'] = []
+        app.config['SQL_INSTRUMENTATION'] = True
+        app.config['SQL_QUERY_BUDGET_STRICT'] = True
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+        views.login_throttle.reset()
+        app.session_interface = ServerSideSessionInterface(MemoryStore(100))
+        # jobs run within the request that queues them, two todos at a time
+        jobs.job_queue = JobQueue(0, 2, 60)
         db.create_all()
 
     def tearDown(self):
@@ -255,6 +335,35 @@ class AlayatodoTests(unittest.TestCase):
             response = get_todos(c)
             assert todo_desc in response.data
 
+    def testShowCompletedPreference(self):
+        """
+        Ensures the show completed preference is saved for the user, and not for whoever else uses the same browser
+        """
+        user, password = create_random_user()
+        other_user, other_password = create_random_user()
+        db.session.add_all([user, other_user])
+        db.session.commit()
+        user_id, username, other_username = user.id, user.username, other_user.username
+        with app.test_client() as c:
+            login(c, username, password)
+            show_completed(c, True)
+            c.get('/logout')
+            login(c, other_username, other_password)
+            response = get_todos(c)
+            assert 'checked' not in response.data
+        self.assertTrue(User.query.get(user_id).show_completed)
+        with app.test_client() as c:
+            login(c, username, password)
+            response = get_todos(c)
+            assert 'checked' in response.data
+            # a change made on another device applies without logging in again
+            with app.test_client() as other_device:
+                login(other_device, username, password)
+                # unchecked boxes are left out of the form
+                other_device.post('/show_completed', follow_redirects=True)
+            response = get_todos(c)
+            assert 'checked' not in response.data
+
     def testDeleteTodo(self):
         db.session.expire_on_commit = False
         user, password = create_random_user()
@@ -273,6 +382,711 @@ class AlayatodoTests(unittest.TestCase):
             response = get_todos(c)
             assert todo_desc not in response.data
 
+    def testCursorEncoding(self):
+        """
+        Ensures cursors survive a round trip and tampered cursors are rejected
+        """
+        user, _ = create_random_user()
+        todo = Todo(description=myFactory.text(), user=user, completed=True)
+        db_commit(todo)
+        self.assertEqual((True, todo.id), decode_cursor(encode_cursor(todo)))
+        for cursor in ('', 'XXX', encode_cursor(todo)[:-1] + '!'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def testKeysetPagination(self):
+        """
+        Ensures cursor pagination walks through every visible todo exactly once, in the same order as page numbers
+        """
+        db.session.expire_on_commit = False
+        user, password = create_random_user()
+        db.session.add(user)
+        todos = [Todo(description='keyset todo {}'.format(i), user=user, completed=i % 3 == 0) for i in range(7)]
+        db.session.add_all(todos)
+        db.session.commit()
+        descriptions = [t.description for t in todos]
+        expected = [t.description for t in sorted(todos, key=lambda t: (t.completed, -t.id))]
+        with app.test_client() as c:
+            login(c, user.username, password)
+            show_completed(c, True)
+            seen = []
+            after = ''
+            while after is not None:
+                response = get_todos_page(c, after=after, per_page=2)
+                self.assertEqual(response.status, '200 OK')
+                data = response.data
+                page = sorted((d for d in descriptions if d in data), key=data.index)
+                self.assertTrue(0 < len(page) <= 2)
+                seen.extend(page)
+                links = [parse_qs(urlsplit(href.replace('&amp;', '&')).query, keep_blank_values=True)
+                         for href in re.findall(r'href="(/todo/\?[^"]*)"', data)]
+                # the first page link has an empty cursor
+                self.assertIn({'after': [''], 'per_page': ['2']}, links)
+                cursors = [link['after'][0] for link in links if link['after'][0]]
+                after = cursors[0] if cursors else None
+            self.assertEqual(expected, seen)
+            response = get_todos_page(c, after='XXX')
+            self.assertEqual(response.status, '400 BAD REQUEST')
+
+    def testTodoCounts(self):
+        """
+        Ensures the per user todo counters follow creations, completions and deletions, and can be rebuilt
+        """
+        db.session.expire_on_commit = False
+        user, password = create_random_user()
+        db_commit(user)
+        user_id = user.id
+        with app.test_client() as c:
+            login(c, user.username, password)
+            create_todo(c, 'first', user)
+            create_todo(c, 'second', user)
+            todo_id = Todo.query.filter_by(description='first').one().id
+            update_completed_todo(c, todo_id, True)
+            update_completed_todo(c, todo_id, True)
+            user = User.query.get(user_id)
+            self.assertEqual((2, 1), (user.todos_count, user.open_todos_count))
+            delete_todo(c, todo_id)
+            user = User.query.get(user_id)
+            self.assertEqual((1, 1), (user.todos_count, user.open_todos_count))
+        db.session.execute(Todo.__table__.insert(), [{'description': 'raw', 'completed': True, 'user_id': user_id}])
+        User.recount_todos()
+        db.session.commit()
+        user = User.query.get(user_id)
+        self.assertEqual((2, 1), (user.todos_count, user.open_todos_count))
+
+    def testApiList(self):
+        """
+        Ensures the API lists every todo of the user, and only theirs, following the cursor
+        """
+        db.session.expire_on_commit = False
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        todos = [create_random_todo(user) for _ in range(5)]
+        db.session.add_all(todos + [create_random_todo(other_user)])
+        db.session.commit()
+        todo_ids = sorted(t.id for t in todos)
+        with app.test_client() as c:
+            self.assertEqual(401, api_todos(c).status_code)
+            login(c, user.username, password)
+            ids = []
+            params = {'limit': 2}
+            while True:
+                data = json.loads(api_todos(c, **params).data)
+                ids.extend(todo['id'] for todo in data['todos'])
+                if data['next'] is None:
+                    break
+                params['after'] = data['next']
+            self.assertEqual(todo_ids, sorted(ids))
+            self.assertEqual(400, api_todos(c, after='XXX').status_code)
+
+    def testApiBatch(self):
+        """
+        Ensures a batch applies every valid item and reports errors for the invalid ones
+        """
+        db.session.expire_on_commit = False
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        todo, to_delete, other_todo = create_random_todo(user), create_random_todo(user), create_random_todo(other_user)
+        db.session.add_all([todo, to_delete, other_todo])
+        db.session.commit()
+        todo_id, to_delete_id, other_todo_id, user_id = todo.id, to_delete.id, other_todo.id, user.id
+        with app.test_client() as c:
+            login(c, user.username, password)
+            response = api_batch(c, {
+                'create': [{'description': 'from the api'}, {'description': ' '}, {'description': 'x' * 256}],
+                'update': [{'id': todo_id, 'completed': True}, {'id': other_todo_id, 'completed': True}],
+                'delete': [to_delete_id, other_todo_id],
+            })
+            self.assertEqual(response.status_code, 200)
+            results = json.loads(response.data)['results']
+            self.assertEqual([201, 400, 400], [r['status'] for r in results['create']])
+            self.assertEqual('from the api', results['create'][0]['todo']['description'])
+            self.assertEqual([200, 404], [r['status'] for r in results['update']])
+            self.assertEqual([200, 404], [r['status'] for r in results['delete']])
+            self.assertEqual(400, api_batch(c, ['not', 'an', 'object']).status_code)
+        self.assertTrue(Todo.query.get(todo_id).completed)
+        self.assertIsNone(Todo.query.get(to_delete_id))
+        self.assertFalse(Todo.query.get(other_todo_id).completed)
+        user = User.query.get(user_id)
+        self.assertEqual((2, 1), (user.todos_count, user.open_todos_count))
+
+    def testExportTodos(self):
+        """
+        Ensures the exports contain every todo of the user, in the same shape as the JSON view
+        """
+        db.session.expire_on_commit = False
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        todos = [create_random_todo(user) for _ in range(2)] + [Todo(description=u'caf\xe9 \u2013 ok', user=user)]
+        db.session.add_all(todos + [create_random_todo(other_user)])
+        db.session.commit()
+        todo_id = todos[0].id
+        with app.test_client() as c:
+            self.assertEqual(401, export_todos(c, 'csv').status_code)
+            login(c, user.username, password)
+            response = export_todos(c, 'ndjson')
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+            self.assertEqual(3, len(lines))
+            self.assertEqual(json.loads(json_todo(c, todo_id).data)['todo'], lines[0])
+            response = export_todos(c, 'csv')
+            self.assertEqual('text/csv', response.mimetype)
+            rows = list(csv.reader(response.data.splitlines(True)))
+            self.assertEqual(['completed', 'description', 'id', 'user'], rows[0])
+            self.assertEqual(4, len(rows))
+            self.assertIn(u'caf\xe9 \u2013 ok', response.get_data(as_text=True))
+            self.assertEqual(404, export_todos(c, 'xml').status_code)
+
+    def testSerializeTodos(self):
+        """
+        Ensures the fast serializer dumps todos and row tuples exactly like TodoSchema
+        """
+        user, _ = create_random_user()
+        todos = [create_random_todo(user) for _ in range(3)]
+        todos[0].completed = True
+        db.session.add_all(todos)
+        db.session.commit()
+        expected = [TodoSchema().dump(todo).data for todo in todos]
+        self.assertEqual(expected, serialize_todos(todos))
+        rows = db.session.query(*TODO_COLUMNS).order_by(Todo.id).all()
+        self.assertEqual(expected, serialize_todos(rows))
+        self.assertEqual(expected[0], todos[0].as_dict())
+
+    def testDatabaseProfiles(self):
+        """
+        Ensures the production profile turns on WAL and a real connection pool, and unknown profiles are rejected
+        """
+        self.assertEqual([], profile_config('development', 'sqlite:////tmp/todo.db')['SQLITE_PRAGMAS'])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        uri = 'sqlite:///{}'.format(os.path.join(directory, 'todo.db'))
+        production = profile_config('production', uri)
+        self.addCleanup(app.config.__setitem__, 'SQLITE_PRAGMAS', app.config['SQLITE_PRAGMAS'])
+        app.config['SQLITE_PRAGMAS'] = production['SQLITE_PRAGMAS']
+        engine = create_engine(uri, **production['SQLALCHEMY_ENGINE_OPTIONS'])
+        self.addCleanup(engine.dispose)
+        self.assertIsInstance(engine.pool, QueuePool)
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'wal')
+            # NORMAL
+            self.assertEqual(connection.execute('PRAGMA synchronous').scalar(), 1)
+        production = profile_config('production', 'postgresql://localhost/todo')
+        self.assertEqual([], production['SQLITE_PRAGMAS'])
+        self.assertNotIn('connect_args', production['SQLALCHEMY_ENGINE_OPTIONS'])
+        with self.assertRaises(ValueError):
+            profile_config('staging', 'sqlite:////tmp/todo.db')
+
+    def testReadReplicaRouting(self):
+        """
+        Ensures read only views are answered by the replica, except right after the user wrote something
+        """
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: 'sqlite://'}
+        try:
+            replica = db.get_engine(app, bind=REPLICA_BIND)
+            db.Model.metadata.create_all(replica)
+            user, password = create_random_user()
+            db_commit(user)
+            replica.execute(User.__table__.insert(), id=user.id, username=user.username,
+                            password_hash=user.password_hash, todos_count=1, open_todos_count=1)
+            replica.execute(Todo.__table__.insert(), description='only in the replica', user_id=user.id)
+            with app.test_client() as c:
+                login(c, user.username, password)
+                self.assertIn('only in the replica', get_todos(c).get_data(as_text=True))
+                response = create_todo(c, 'only in the primary', user)
+                self.assertIn('only in the primary', response.get_data(as_text=True))
+        finally:
+            app.config['SQLALCHEMY_BINDS'] = None
+            db.session.remove()
+            replica.dispose()
+
+    def testBulkSeed(self):
+        """
+        Ensures the bulk seeder inserts every generated user and todo, with matching counters, across several chunks
+        """
+        self.assertEqual((5, 15), bulk_seed(fake_users(5, 3, 'secret'), chunk_size=4, password='secret'))
+        users = User.query.all()
+        self.assertEqual(5, len(users))
+        self.assertEqual(1, len(set(user.password_hash for user in users)))
+        self.assertTrue(users[0].check_password('secret'))
+        for user in users:
+            self.assertEqual(3, user.todos_count)
+            self.assertEqual(user.todos.filter(Todo.completed == False).count(), user.open_todos_count)
+        self.assertEqual(Todo.query.filter(Todo.completed == (Todo.completed_at == None)).count(), 0)
+        # the database assigned the ids, so its sequence (if it has one) is past them
+        user, _ = create_random_user()
+        db_commit(user)
+        self.assertEqual(6, User.query.count())
+
+    def testQueryInstrumentation(self):
+        """
+        Ensures responses report their SQL time and views going over their query budget fail
+        """
+        user, password = create_random_user()
+        db_commit(user)
+        budgets = app.config['SQL_QUERY_BUDGETS']
+        try:
+            with app.test_client() as c:
+                login(c, user.username, password)
+                self.assertIn('desc="2 queries"', get_todos(c).headers['Server-Timing'])
+                app.config['SQL_QUERY_BUDGETS'] = dict(budgets, todos=1)
+                with self.assertRaises(QueryBudgetExceeded):
+                    get_todos(c)
+        finally:
+            app.config['SQL_QUERY_BUDGETS'] = budgets
+
+    def testPasswordVerifier(self):
+        """
+        Ensures passwords are checked the same way in the hashing pool as on the request thread, and that checks
+        waiting too long for the pool are rejected
+        """
+        user, password = create_random_user()
+        for verifier in (PasswordVerifier(2, 4, 5), PasswordVerifier(0, 0, 5)):
+            self.assertTrue(verifier.verify(user.password_hash, password))
+            self.assertFalse(verifier.verify(user.password_hash, '{}XXX'.format(password)))
+        verifier = PasswordVerifier(1, 0, 0.2)
+        started, finish = threading.Event(), threading.Event()
+
+        def hold_pool():
+            started.set()
+            finish.wait()
+
+        def check_slowly():
+            try:
+                verifier._run(hold_pool)
+            except LoginUnavailable:
+                pass
+
+        busy = threading.Thread(target=check_slowly)
+        busy.start()
+        started.wait()
+        with self.assertRaises(LoginUnavailable):
+            verifier.verify(user.password_hash, password)
+        finish.set()
+        busy.join()
+        self.assertTrue(verifier.verify(user.password_hash, password))
+
+    def testLoginThrottle(self):
+        """
+        Ensures a username is locked out from an IP address after too many failed logins, without affecting other
+        users or the same user elsewhere
+        """
+        user, password = create_random_user()
+        other_user, other_password = create_random_user()
+        db.session.add_all([user, other_user])
+        db.session.commit()
+        username, other_username = user.username, other_user.username
+        with app.test_client() as c:
+            for _ in range(app.config['LOGIN_MAX_FAILURES_PER_USERNAME']):
+                response = login(c, username, '{}XXX'.format(password))
+                assert 'Invalid username or password' in response.data
+            response = login(c, username, password)
+            self.assertEqual(response.status_code, 429)
+            assert 'Too many login attempts' in response.data
+            response = login(c, other_username, other_password)
+            assert 'Successful login' in response.data
+        with app.test_client() as c:
+            response = c.post('/login', data=dict(username=username, password=password), follow_redirects=True,
+                              environ_base={'REMOTE_ADDR': '10.0.0.2'})
+            assert 'Successful login' in response.data
+
+    def testPasswordRehash(self):
+        """
+        Ensures a password hashed with outdated parameters is rehashed with the configured ones on a successful login
+        """
+        user, password = create_random_user()
+        db_commit(user)
+        user_id, username = user.id, user.username
+        self.assertFalse(user.password_needs_rehash())
+        app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertTrue(user.password_needs_rehash())
+        with app.test_client() as c:
+            response = login(c, username, '{}XXX'.format(password))
+            assert 'Invalid username or password' in response.data
+            self.assertTrue(needs_rehash(User.query.get(user_id).password_hash, 'pbkdf2:sha256:2000'))
+            response = login(c, username, password)
+            assert 'Successful login' in response.data
+        password_hash = User.query.get(user_id).password_hash
+        self.assertTrue(password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertFalse(needs_rehash(password_hash, 'pbkdf2:sha256:2000'))
+
+    def testServerSideSessions(self):
+        """
+        Ensures the session cookie only carries an id, renewed on login, and the session data is kept in the store
+        """
+        user, password = create_random_user()
+        db_commit(user)
+        username = user.username
+        store = app.session_interface.store
+        with app.test_client() as c:
+            visit_login(c)
+            anonymous_sid = session_id(c)
+            login(c, username, password)
+            sid = session_id(c)
+            self.assertNotEqual(sid, anonymous_sid)
+            self.assertIsNone(store.load(anonymous_sid))
+            assert username in store.load(sid)
+            show_completed(c, True)
+            # kept on the user, see testShowCompletedPreference
+            assert 'show_completed' not in store.load(sid)
+            c.get('/logout')
+            self.assertIsNone(store.load(sid))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, 'sessions.db')
+        sqlite_store = SqliteStore(path)
+        sqlite_store.save('sid', '{}', time.time() + 60)
+        # readable by the user running the app only, like the default directory
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.stat(os.path.dirname(private_sessions_path())).st_mode & 0o777, 0o700)
+        if os.getuid() == 0:
+            # only root can hand a file over to another user
+            planted = os.path.join(directory, 'planted.db')
+            open(planted, 'w').close()
+            os.chown(planted, 1, 1)
+            with self.assertRaises(RuntimeError):
+                SqliteStore(planted).load('sid')
+        sqlite_store.save('expired', '{}', time.time() - 1)
+        self.assertEqual(sqlite_store.load('sid'), '{}')
+        self.assertIsNone(sqlite_store.load('expired'))
+        sqlite_store.delete('sid')
+        self.assertIsNone(sqlite_store.load('sid'))
+
+    def testHomeCache(self):
+        """
+        Ensures the home page is rendered once per README version and user, and conditional requests get a 304
+        """
+        views.home_cache.clear()
+        user, password = create_random_user()
+        db_commit(user)
+        username = user.username
+        with app.test_client() as c:
+            response = c.get('/')
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            assert response.headers['Last-Modified']
+            self.assertEqual(len(views.home_cache), 1)
+            response = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(len(views.home_cache), 1)
+            login(c, username, password)
+            response = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            assert username.encode('utf-8') in response.data
+            self.assertEqual(len(views.home_cache), 2)
+            response = c.get('/logout', follow_redirects=True)
+            assert 'You were logged out' in response.data
+            self.assertEqual(len(views.home_cache), 2)
+
+    def testConditionalTodoViews(self):
+        """
+        Ensures the todo views answer 304 from the todos version alone until the user's todos change
+        """
+        user, password = create_random_user()
+        todo = create_random_todo(user)
+        db.session.add_all([user, todo])
+        db.session.commit()
+        username, todo_id = user.username, todo.id
+        json_url = '/todo/{}/json'.format(todo_id)
+        with app.test_client() as c:
+            login(c, username, password)
+            response = c.get(json_url)
+            etag = response.headers['ETag']
+            assert 'private' in response.headers['Cache-Control']
+            response = c.get(json_url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            assert '"1 queries"' in response.headers['Server-Timing']
+            response = c.get('/todo/')
+            page_etag = response.headers['ETag']
+            response = c.get('/todo/', headers={'If-None-Match': page_etag})
+            self.assertEqual(response.status_code, 304)
+            response = c.get('/todo/?page=2', headers={'If-None-Match': page_etag})
+            self.assertEqual(response.status_code, 200)
+            update_completed_todo(c, todo_id, True)
+            response = c.get(json_url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(json.loads(response.data)['todo']['completed'])
+            response = c.get('/todo/', headers={'If-None-Match': page_etag})
+            self.assertEqual(response.status_code, 200)
+
+    def testSearchTodos(self):
+        """
+        Ensures search finds the user's todos containing every term, best match first, and follows their changes
+        """
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        descriptions = ['Buy milk', 'Buy bread and milk', 'Walk the dog', 'Milk, milk and more milk']
+        todos = [Todo(description=description, user=user) for description in descriptions]
+        db.session.add_all(todos + [other_user, Todo(description='Buy milk', user=other_user)])
+        db.session.commit()
+        username, ids = user.username, [todo.id for todo in todos]
+        with app.test_client() as c:
+            login(c, username, password)
+            response = search_todos(c, 'milk')
+            data = json.loads(response.data)
+            found = [todo['id'] for todo in data['todos']]
+            if db.engine.dialect.name == 'sqlite':
+                # ranked with BM25, other databases fall back to newest first
+                self.assertEqual(found, [ids[3], ids[0], ids[1]])
+            self.assertEqual(sorted(found), [ids[0], ids[1], ids[3]])
+            self.assertIsNone(data['next_page'])
+            data = json.loads(search_todos(c, 'MILK buy', limit=1).data)
+            self.assertEqual(len(data['todos']), 1)
+            self.assertEqual(data['next_page'], 2)
+            data = json.loads(search_todos(c, 'milk buy', limit=1, page=2).data)
+            self.assertEqual(len(data['todos']), 1)
+            self.assertIsNone(data['next_page'])
+            self.assertEqual(json.loads(search_todos(c, '"dog OR user_id:*').data)['todos'], [])
+            self.assertEqual(search_todos(c, ' ').status_code, 400)
+            api_batch(c, {'delete': [ids[0]]})
+            todo = Todo.query.get(ids[2])
+            todo.description = 'Walk the cat'
+            db.session.commit()
+            self.assertEqual(json.loads(search_todos(c, 'dog').data)['todos'], [])
+            self.assertEqual(len(json.loads(search_todos(c, 'cat').data)['todos']), 1)
+            self.assertEqual(len(json.loads(search_todos(c, 'milk').data)['todos']), 2)
+
+    def testJobs(self):
+        """
+        Ensures bulk operations run as jobs only touch the user's todos, keep the counters right and can be resumed
+        """
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        db.session.add_all([create_random_todo(user) for _ in range(5)] + [create_random_todo(other_user)])
+        db.session.commit()
+        username, user_id, other_user_id = user.username, user.id, other_user.id
+        with app.test_client() as c:
+            login(c, username, password)
+            response = queue_job(c, 'complete_all')
+            self.assertEqual(response.status_code, 202)
+            job = json.loads(get_job(c, json.loads(response.data)['job']['id']).data)['job']
+            self.assertEqual((job['status'], job['processed']), ('done', 5))
+            self.assertTrue(response.headers['Location'].endswith('/api/todos/jobs/{}'.format(job['id'])))
+            self.assertEqual(User.query.get(user_id).open_todos_count, 0)
+            self.assertEqual(User.query.get(other_user_id).open_todos_count, 1)
+            response = queue_job(c, 'import', descriptions=['Buy milk', 'Walk the dog', 'Call mom'])
+            self.assertEqual(json.loads(get_job(c, json.loads(response.data)['job']['id']).data)['job']['processed'], 3)
+            self.assertEqual(queue_job(c, 'import', descriptions=['Buy milk', '']).status_code, 400)
+            self.assertEqual(queue_job(c, 'drop_tables').status_code, 400)
+            response = c.post('/todo/jobs', data=dict(kind='delete_completed'), follow_redirects=True)
+            assert 'Your todos are being cleaned up.' in response.data
+            self.assertEqual(Todo.query.filter_by(user_id=user_id).count(), 3)
+            user = User.query.get(user_id)
+            self.assertEqual((user.todos_count, user.open_todos_count), (3, 3))
+            self.assertEqual(Todo.query.filter_by(user_id=other_user_id).count(), 1)
+            other_job = Job(user_id=other_user_id, kind='complete_all')
+            db_commit(other_job)
+            other_job_id = other_job.id
+            self.assertEqual(get_job(c, other_job_id).status_code, 404)
+        # a job left queued by a process that died is picked up again
+        self.assertEqual(jobs.job_queue.resume(), [other_job_id])
+        # jobs write with core statements, behind the back of the objects loaded here
+        db.session.expire_all()
+        self.assertEqual(Job.query.get(other_job_id).status, 'done')
+        self.assertEqual(User.query.get(other_user_id).open_todos_count, 0)
+
+    def testTodoListRendering(self):
+        """
+        Ensures the todo list shares a single delete dialog between its rows and caps how many rows it renders
+        """
+        app.config['TODOS_PER_PAGE_LIMIT'] = 2
+        self.addCleanup(app.config.__setitem__, 'TODOS_PER_PAGE_LIMIT', 100)
+        user, password = create_random_user()
+        db.session.add_all([create_random_todo(user) for _ in range(3)])
+        db.session.commit()
+        with app.test_client() as c:
+            login(c, user.username, password)
+            response = get_todos_page(c, per_page=1000)
+            self.assertEqual(response.data.count('data-target="#delete_todo_modal"'), 2)
+            self.assertEqual(response.data.count('id="delete_todo_modal"'), 1)
+            self.assertEqual(response.data.count('name="completed"'), 2)
+            response = get_todos_page(c, per_page=0)
+            self.assertEqual(response.data.count('name="completed"'), 1)
+
+    def testTemplateCache(self):
+        """
+        Ensures compiled templates are only cached in directories private to the user running the app
+        """
+        self.assertIsNone(template_bytecode_cache(''))
+        self.assertIsNotNone(template_bytecode_cache(None))
+        parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parent, True)
+        directory = os.path.join(parent, 'templates')
+        template_bytecode_cache(directory)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def testFragmentResponses(self):
+        """
+        Ensures the todo list scripts get the changed part of the page back instead of a redirect
+        """
+        user, password = create_random_user()
+        db_commit(user)
+        with app.test_client() as c:
+            login(c, user.username, password)
+            response = post_fragment(c, '/todo/', description='Buy milk')
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data)
+            todo_id = data['todo']['id']
+            assert 'Buy milk' in data['html'] and 'data-todo_id="{}"'.format(todo_id) in data['html']
+            self.assertEqual(post_fragment(c, '/todo/', description=' ').status_code, 400)
+            data = json.loads(post_fragment(c, '/todo/{}'.format(todo_id), completed='on').data)
+            self.assertEqual((data['todo']['completed'], data['html']), (True, ''))
+            response = post_fragment(c, '/show_completed', show_completed='on', per_page=5)
+            assert '<html' not in response.data
+            assert 'id="todo_list"' in response.data and 'Buy milk' in response.data
+            data = json.loads(post_fragment(c, '/todo/{}'.format(todo_id)).data)
+            assert 'Buy milk' in data['html']
+            response = c.delete('/todo/{}'.format(todo_id), headers={'X-Fragment': '1'})
+            self.assertEqual(json.loads(response.data)['message'], 'Todo has been deleted.')
+            # nothing was flashed for the next page
+            response = get_todos(c)
+            assert 'Todo has been deleted.' not in response.data
+
+    def testChangeFeed(self):
+        """
+        Ensures the change feed streams the changes to the user's todos in order, and resumes after Last-Event-ID
+        """
+        app.config['FEED_MAX_SECONDS'] = 0
+        self.addCleanup(app.config.__setitem__, 'FEED_MAX_SECONDS', 300)
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        db.session.add_all([user, other_user, create_random_todo(other_user)])
+        db.session.commit()
+        username, user_id = user.username, user.id
+        # a client preserving request contexts would keep the stream's copy of its context pushed
+        c = app.test_client()
+        login(c, username, password)
+        self.assertEqual(todo_events(c), [])
+        create_todo(c, 'Buy milk', User.query.get(user_id))
+        create_todo(c, 'Walk the dog', User.query.get(user_id))
+        milk, dog = [todo.id for todo in Todo.query.filter_by(user_id=user_id).order_by(Todo.id)]
+        update_completed_todo(c, milk, True)
+        delete_todo(c, dog)
+        events = todo_events(c, **{'Last-Event-ID': '0'})
+        self.assertEqual([(event, data['action'], data['todo_id']) for _, event, data in events],
+                         [('todo', 'created', milk), ('todo', 'created', dog), ('todo', 'updated', milk),
+                          ('todo', 'deleted', dog)])
+        self.assertEqual(events[2][2]['todo']['completed'], True)
+        self.assertIsNone(events[3][2]['todo'])
+        self.assertEqual([event_id for event_id, _, _ in todo_events(c, **{'Last-Event-ID': str(events[1][0])})],
+                         [event_id for event_id, _, _ in events[2:]])
+        queue_job(c, 'complete_all')
+        self.assertEqual([event for _, event, _ in todo_events(c, **{'Last-Event-ID': str(events[3][0])})],
+                         ['reset'])
+        self.assertEqual(c.get('/api/todos/events', headers={'Last-Event-ID': 'last'}).status_code, 400)
+        # changes are pruned by age, but the latest one is kept
+        self.assertGreater(prune_changes(datetime.timedelta(days=-1), 2), len(events))
+        self.assertEqual(TodoChange.query.count(), 1)
+        resumed = todo_events(c, **{'Last-Event-ID': str(events[0][0])})
+        self.assertEqual([(event, data['action']) for _, event, data in resumed], [('reset', 'reset')])
+        self.assertEqual(todo_events(c, **{'Last-Event-ID': str(resumed[0][0])}), [])
+        feed = ChangeFeed()
+        generation = feed.generation
+        feed.notify()
+        self.assertEqual(feed.wait(generation, 5), generation + 1)
+
+    def testDeltaSync(self):
+        """
+        Ensures a sync since a version returns what changed and what was deleted after it, a page at a time
+        """
+        user, password = create_random_user()
+        other_user, _ = create_random_user()
+        db.session.add_all([create_random_todo(user) for _ in range(3)] + [create_random_todo(other_user)])
+        db.session.commit()
+        username, user_id = user.username, user.id
+        first, second, third = [todo.id for todo in Todo.query.filter_by(user_id=user_id).order_by(Todo.id)]
+        with app.test_client() as c:
+            login(c, username, password)
+            response = sync_todos(c)
+            full = json.loads(response.data)
+            self.assertEqual(sorted(todo['id'] for todo in full['todos']), [first, second, third])
+            self.assertEqual((full['deleted'], full['next']), ([], None))
+            self.assertEqual(json.loads(sync_todos(c, since=full['version']).data)['todos'], [])
+            update_completed_todo(c, second, True)
+            delete_todo(c, third)
+            response = sync_todos(c, since=full['version'])
+            delta = json.loads(response.data)
+            self.assertEqual([(todo['id'], todo['completed']) for todo in delta['todos']], [(second, True)])
+            self.assertEqual(delta['deleted'], [third])
+            self.assertGreater(delta['version'], full['version'])
+            response = sync_todos(c, limit=1)
+            page = json.loads(response.data)
+            response = sync_todos(c, limit=1, after=page['next'])
+            last_page = json.loads(response.data)
+            self.assertEqual([todo['id'] for todo in page['todos'] + last_page['todos']], [first, second])
+            self.assertIsNone(last_page['next'])
+            self.assertEqual(sync_todos(c, after='bogus').status_code, 400)
+            self.assertEqual(sync_todos(c, since='yesterday').status_code, 400)
+            queue_job(c, 'delete_completed')
+            response = sync_todos(c, since=delta['version'])
+            self.assertEqual(json.loads(response.data)['deleted'], [second])
+            create_todo(c, 'Deleted', User.query.get(user_id))
+            newest = db.session.query(db.func.max(Todo.id)).scalar()
+            delete_todo(c, newest)
+            create_todo(c, 'Created', User.query.get(user_id))
+            response = sync_todos(c, since=delta['version'])
+            changes = json.loads(response.data)
+            created = [todo['id'] for todo in changes['todos']]
+            self.assertEqual(len(created), 1)
+            self.assertGreater(created[0], newest)
+            self.assertFalse(set(created) & set(changes['deleted']))
+
+    def testArchive(self):
+        """
+        Ensures old completed todos move to the archive, and are still shown, served and deletable from there
+        """
+        user, password = create_random_user()
+        db.session.add_all([create_random_todo(user) for _ in range(4)])
+        db.session.commit()
+        username, user_id = user.username, user.id
+        old, recent, archived, newest = [todo.id for todo in Todo.query.filter_by(user_id=user_id).order_by(Todo.id)]
+        with app.test_client() as c:
+            login(c, username, password)
+            since = json.loads(sync_todos(c).data)['version']
+            for todo_id in (old, recent, archived):
+                update_completed_todo(c, todo_id, True)
+        Todo.query.filter(Todo.id.in_([old, archived])).update(
+            {'completed_at': datetime.datetime.utcnow() - datetime.timedelta(days=31)}, synchronize_session=False)
+        db.session.commit()
+        self.assertEqual(archive_todos(datetime.timedelta(days=30), 1), 2)
+        db.session.expire_all()
+        self.assertEqual(sorted(todo.id for todo in ArchivedTodo.query.filter_by(user_id=user_id)), [old, archived])
+        self.assertEqual([todo.id for todo in Todo.query.filter_by(user_id=user_id).order_by(Todo.id)],
+                         [recent, newest])
+        self.assertEqual(User.query.get(user_id).todos_count, 4)
+        with app.test_client() as c:
+            login(c, username, password)
+            self.assertEqual(get_todo(c, archived).status_code, 200)
+            self.assertEqual(json.loads(json_todo(c, archived).data)['todo']['completed'], True)
+            show_completed(c, True)
+            response = get_todos(c)
+            self.assertEqual(response.data.count('title="Archived"'), 2)
+            response = api_todos(c, limit=3)
+            page = json.loads(response.data)
+            response = api_todos(c, limit=3, after=page['next'])
+            self.assertEqual([todo['id'] for todo in page['todos'] + json.loads(response.data)['todos']],
+                             [newest, archived, recent, old])
+            response = sync_todos(c)
+            self.assertEqual(sorted(todo['id'] for todo in json.loads(response.data)['todos']),
+                             [old, recent, archived, newest])
+            response = sync_todos(c, since=since)
+            self.assertEqual(sorted((todo['id'], todo['completed']) for todo in json.loads(response.data)['todos']),
+                             [(old, True), (recent, True), (archived, True)])
+            response = export_todos(c, 'ndjson')
+            self.assertEqual([json.loads(line)['id'] for line in response.data.splitlines()],
+                             [old, recent, archived, newest])
+            self.assertEqual(delete_todo(c, archived).status_code, 200)
+            self.assertEqual(get_todo(c, archived).status_code, 404)
+            self.assertEqual(User.query.get(user_id).todos_count, 3)
+            queue_job(c, 'delete_completed')
+            self.assertEqual(ArchivedTodo.query.filter_by(user_id=user_id).count(), 0)
+            update_completed_todo(c, newest, True)
+            Todo.query.filter_by(id=newest).update(
+                {'completed_at': datetime.datetime.utcnow() - datetime.timedelta(days=31)}, synchronize_session=False)
+            db.session.commit()
+            self.assertEqual(archive_todos(datetime.timedelta(days=30), 1), 1)
+            create_todo(c, 'After the archived one', User.query.get(user_id))
+            self.assertGreater(db.session.query(db.func.max(Todo.id)).scalar(), newest)
+
 
 if __name__ == '__main__':
     unittest.main()